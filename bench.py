@@ -0,0 +1,339 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INTERPRET = os.path.join(ROOT, "interpret_old.py")
+
+HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<program language="IPPcode23">\n'
+
+
+class ProgramWriter:
+    def __init__(self):
+        self.lines = [HEADER]
+        self.order = 0
+
+    def add(self, opcode, *args):
+        self.order += 1
+        line = f'<instruction order="{self.order}" opcode="{opcode}">'
+        for i, (argtype, text) in enumerate(args, 1):
+            line += f'<arg{i} type="{argtype}">{text}</arg{i}>'
+        self.lines.append(line + "</instruction>\n")
+
+    def text(self):
+        return "".join(self.lines) + "</program>\n"
+
+
+def loopProgram(n):
+    # counting loop with a frame round trip and a compare-and-branch per iteration
+    p = ProgramWriter()
+    p.add("DEFVAR", ("var", "GF@i"))
+    p.add("MOVE", ("var", "GF@i"), ("int", "0"))
+    p.add("DEFVAR", ("var", "GF@c"))
+    p.add("LABEL", ("label", "loop"))
+    p.add("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1"))
+    p.add("CREATEFRAME")
+    p.add("PUSHFRAME")
+    p.add("DEFVAR", ("var", "LF@x"))
+    p.add("MOVE", ("var", "LF@x"), ("var", "GF@i"))
+    p.add("POPFRAME")
+    p.add("LT", ("var", "GF@c"), ("var", "GF@i"), ("int", str(n)))
+    p.add("JUMPIFEQ", ("label", "loop"), ("var", "GF@c"), ("bool", "true"))
+    p.add("WRITE", ("var", "GF@i"))
+    return p.text()
+
+
+def recursionProgram(n):
+    # recursive function descending to depth n, one local frame per call
+    p = ProgramWriter()
+    p.add("DEFVAR", ("var", "GF@n"))
+    p.add("MOVE", ("var", "GF@n"), ("int", str(n)))
+    p.add("CALL", ("label", "rec"))
+    p.add("WRITE", ("var", "GF@n"))
+    p.add("EXIT", ("int", "0"))
+    p.add("LABEL", ("label", "rec"))
+    p.add("CREATEFRAME")
+    p.add("PUSHFRAME")
+    p.add("DEFVAR", ("var", "LF@x"))
+    p.add("MOVE", ("var", "LF@x"), ("var", "GF@n"))
+    p.add("JUMPIFEQ", ("label", "rec_end"), ("var", "LF@x"), ("int", "0"))
+    p.add("SUB", ("var", "GF@n"), ("var", "GF@n"), ("int", "1"))
+    p.add("CALL", ("label", "rec"))
+    p.add("LABEL", ("label", "rec_end"))
+    p.add("POPFRAME")
+    p.add("RETURN")
+    return p.text()
+
+
+def stringProgram(n):
+    # string building loop: CONCAT, STRLEN and GETCHAR on a growing string
+    p = ProgramWriter()
+    p.add("DEFVAR", ("var", "GF@s"))
+    p.add("MOVE", ("var", "GF@s"), ("string", ""))
+    p.add("DEFVAR", ("var", "GF@len"))
+    p.add("DEFVAR", ("var", "GF@c"))
+    p.add("LABEL", ("label", "loop"))
+    p.add("CONCAT", ("var", "GF@s"), ("var", "GF@s"), ("string", "x"))
+    p.add("STRLEN", ("var", "GF@len"), ("var", "GF@s"))
+    p.add("SUB", ("var", "GF@len"), ("var", "GF@len"), ("int", "1"))
+    p.add("GETCHAR", ("var", "GF@c"), ("var", "GF@s"), ("var", "GF@len"))
+    p.add("ADD", ("var", "GF@len"), ("var", "GF@len"), ("int", "1"))
+    p.add("JUMPIFNEQ", ("label", "loop"), ("var", "GF@len"), ("int", str(n)))
+    p.add("WRITE", ("var", "GF@len"))
+    return p.text()
+
+
+def stackProgram(n, native=True):
+    # sum of 3 * i for i < n evaluated on the data stack; without the native
+    # stack instructions every operation goes through frame variables, the way
+    # code for the base instruction set has to emulate it
+    p = ProgramWriter()
+    p.add("DEFVAR", ("var", "GF@i"))
+    p.add("MOVE", ("var", "GF@i"), ("int", "0"))
+    p.add("DEFVAR", ("var", "GF@sum"))
+    p.add("MOVE", ("var", "GF@sum"), ("int", "0"))
+    p.add("DEFVAR", ("var", "GF@a"))
+    p.add("DEFVAR", ("var", "GF@b"))
+
+    def binary(opcode):
+        if native:
+            p.add(opcode + "S")
+        else:
+            p.add("POPS", ("var", "GF@b"))
+            p.add("POPS", ("var", "GF@a"))
+            p.add(opcode, ("var", "GF@a"), ("var", "GF@a"), ("var", "GF@b"))
+            p.add("PUSHS", ("var", "GF@a"))
+
+    p.add("LABEL", ("label", "loop"))
+    p.add("PUSHS", ("var", "GF@sum"))
+    p.add("PUSHS", ("var", "GF@i"))
+    p.add("PUSHS", ("int", "3"))
+    binary("MUL")
+    binary("ADD")
+    p.add("POPS", ("var", "GF@sum"))
+    p.add("PUSHS", ("var", "GF@i"))
+    p.add("PUSHS", ("int", "1"))
+    binary("ADD")
+    p.add("POPS", ("var", "GF@i"))
+    p.add("PUSHS", ("var", "GF@i"))
+    p.add("PUSHS", ("int", str(n)))
+    if native:
+        p.add("JUMPIFNEQS", ("label", "loop"))
+    else:
+        p.add("POPS", ("var", "GF@b"))
+        p.add("POPS", ("var", "GF@a"))
+        p.add("JUMPIFNEQ", ("label", "loop"), ("var", "GF@a"), ("var", "GF@b"))
+    p.add("WRITE", ("var", "GF@sum"))
+    return p.text()
+
+
+def emulatedStackProgram(n):
+    return stackProgram(n, native=False)
+
+
+def emptyProgram():
+    return ProgramWriter().text()
+
+
+SYNTHETIC = {
+    "loop": (loopProgram, 100000),
+    "recursion": (recursionProgram, 50000),
+    "string": (stringProgram, 20000),
+    "stack": (stackProgram, 50000),
+    "stack_emulated": (emulatedStackProgram, 50000),
+}
+
+
+def corpusBenchmarks():
+    benchmarks = {}
+    for source in sorted(glob.glob(os.path.join(ROOT, "ipp-2023-tests", "koule", "*", "*.xml"))):
+        benchmarks[os.path.splitext(os.path.basename(source))[0]] = (source, None)
+    ultra = os.path.join(ROOT, "test_nevol", "ultra_test")
+    if os.path.exists(ultra + ".src"):
+        benchmarks["ultra_test"] = (ultra + ".src", ultra + ".in")
+    return benchmarks
+
+
+def runOne(source, inputFile, resultFile, optimize):
+    # Executed in a child process: loads and runs one program in-process while
+    # counting executed instructions, then stores the measurements as JSON.
+    sys.path.insert(0, ROOT)
+    import interpret_old
+
+    class CountingInterpreter(interpret_old.Interpreter):
+        executed = 0
+
+        def execute(self):
+            program = self.program
+            end = len(program)
+            position = 0
+            executed = 0
+            try:
+                while position < end:
+                    instr = program[position]
+                    position = instr.handler(self, instr, position) + 1
+                    executed += 1
+            finally:
+                self.executed = executed
+
+    stream = open(inputFile, "r") if inputFile else open(os.devnull, "r")
+    output = interpret_old.OutputBuffer(open(os.devnull, "w"))
+    interpreter = None
+    code = 0
+    start = time.perf_counter()
+    try:
+        program = interpret_old.Program()
+        interpret_old.loadProgram(source, program)
+        program.finish(optimize)
+        loaded = time.perf_counter()
+        interpreter = CountingInterpreter(program, interpret_old.InputReader(stream), output)
+        interpreter.interpretInst()
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    finally:
+        end = time.perf_counter()
+    if not "loaded" in locals():
+        loaded = end
+
+    with open(resultFile, "w") as f:
+        json.dump({
+            "exit_code": code,
+            "load_time": loaded - start,
+            "run_time": end - loaded,
+            "instructions": interpreter.executed if interpreter else 0,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }, f)
+
+
+def measure(source, inputFile, repeat, optimize):
+    # A benchmark whose program ends with a nonzero exit code (or whose child
+    # process crashes) is marked as failed, its timing measures nothing useful.
+    best = None
+    for _ in range(repeat):
+        with tempfile.NamedTemporaryFile(suffix=".json") as result:
+            start = time.perf_counter()
+            child = subprocess.run([sys.executable, __file__, "--run-one", source, inputFile or "", result.name,
+                                    str(optimize)], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            wall = time.perf_counter() - start
+            if child.returncode != 0:
+                lines = child.stderr.strip().splitlines()
+                return {"failed": True, "exit_code": None, "error": lines[-1] if lines else f"exit code {child.returncode}"}
+            with open(result.name) as f:
+                data = json.load(f)
+        if data["exit_code"] != 0:
+            data["failed"] = True
+            return data
+        data["failed"] = False
+        data["wall_time"] = wall
+        runTime = data["run_time"]
+        data["instructions_per_second"] = data["instructions"] / runTime if runTime > 0 else 0
+        if best == None or measuredTime(data) < measuredTime(best):
+            best = data
+    return best
+
+
+def measureStartup(workdir, repeat):
+    source = os.path.join(workdir, "empty.xml")
+    with open(source, "w") as f:
+        f.write(emptyProgram())
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, INTERPRET, "--source=" + source, "--input=" + os.devnull],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def measuredTime(result):
+    # loading and running inside the child, without the interpreter startup
+    # that dominates wall_time of small benchmarks
+    return result["load_time"] + result["run_time"]
+
+
+def compare(old, new, threshold):
+    regressions = 0
+    print(f"{'benchmark':<24}{'old [s]':>10}{'new [s]':>10}{'change':>10}{'old wall':>10}{'new wall':>10}")
+    for name, result in new["benchmarks"].items():
+        if not name in old["benchmarks"]:
+            continue
+        if result.get("failed") or old["benchmarks"][name].get("failed"):
+            print(f"{name:<24}{'failed, not compared':>30}")
+            continue
+        before = measuredTime(old["benchmarks"][name])
+        after = measuredTime(result)
+        change = (after - before) / before if before > 0 else 0
+        mark = ""
+        if change > threshold:
+            regressions += 1
+            mark = "  REGRESSION"
+        print(f"{name:<24}{before:>10.3f}{after:>10.3f}{change:>+10.1%}"
+              f"{old['benchmarks'][name]['wall_time']:>10.3f}{result['wall_time']:>10.3f}{mark}")
+    return regressions
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 6 and sys.argv[1] == "--run-one":
+        runOne(sys.argv[2], sys.argv[3] or None, sys.argv[4], sys.argv[5] == "True")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmarks for interpret_old.py")
+    parser.add_argument("benchmarks", nargs="*", help="Names of benchmarks to run (default: all)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown of load and run time reported as a regression (default 0.10)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the one with the fastest load and run is kept")
+    parser.add_argument("--optimize", action="store_true", help="Run the programs with --optimize")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for the size of synthetic benchmarks")
+    args = parser.parse_args()
+
+    results = {"revision": revision(), "python": sys.version.split()[0], "optimize": args.optimize,
+               "benchmarks": {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks = corpusBenchmarks()
+        for name, (generator, size) in SYNTHETIC.items():
+            n = max(1, int(size * args.scale))
+            source = os.path.join(workdir, f"{name}_{n}.xml")
+            with open(source, "w") as f:
+                f.write(generator(n))
+            benchmarks[f"{name}_{n}"] = (source, None)
+
+        results["startup_time"] = measureStartup(workdir, args.repeat)
+        print(f"startup: {results['startup_time']:.3f} s")
+        for name, (source, inputFile) in benchmarks.items():
+            if args.benchmarks and not any(name.startswith(b) for b in args.benchmarks):
+                continue
+            result = measure(source, inputFile, args.repeat, args.optimize)
+            results["benchmarks"][name] = result
+            if result["failed"]:
+                print(f"{name}: FAILED, " + (result["error"] if "error" in result else
+                                             f"exit code {result['exit_code']} after {result['instructions']} instructions"))
+                continue
+            print(f"{name}: {result['wall_time']:.3f} s, {result['instructions']} instructions, "
+                  f"{result['instructions_per_second']:.0f} instr/s, {result['peak_rss_kb']} KB, "
+                  f"exit code {result['exit_code']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, results, args.threshold) > 0:
+            sys.exit(1)
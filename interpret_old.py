@@ -1,37 +1,174 @@
 import codecs
+import contextlib
 import re
 import xml.etree.ElementTree as ET
 import fileinput
+import gc
+import glob
 import argparse
+import asyncio
+import hashlib
+import importlib.util
+import io
+import marshal
+import multiprocessing
+import mmap
+import json
+import os
+import resource
+import shutil
+import signal
+import stat
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+class Nil:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "nil"
+
+class StringBuffer:
+    # Mutable string value of a single variable, created by CONCAT appending to
+    # its own first operand and by SETCHAR. Appended pieces are collected as a
+    # list until the string is indexed, then it switches to a list of
+    # characters. Reads through getSymb get the flat str, so a buffer never
+    # leaves its frame slot and no other variable can see it change.
+    __slots__ = ("parts", "chars", "length", "flat")
+
+    def __init__(self, text):
+        self.parts = [text]
+        self.chars = None
+        self.length = len(text)
+        self.flat = text
+
+    def append(self, text):
+        if self.chars is not None:
+            self.chars.extend(text)
+        else:
+            self.parts.append(text)
+        self.length += len(text)
+        self.flat = None
+
+    def charList(self):
+        if self.chars is None:
+            self.chars = list(self.value())
+            self.parts = None
+        return self.chars
+
+    def setChar(self, index, char):
+        self.charList()[index] = char
+        self.flat = None
+
+    def value(self):
+        if self.flat is None:
+            if self.chars is not None:
+                self.flat = "".join(self.chars)
+            else:
+                self.flat = "".join(self.parts)
+                self.parts = [self.flat]
+        return self.flat
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.charList()[index]
+
+    def __repr__(self):
+        return repr(self.value())
+
+# Runtime values are carried as native Python objects, so the class of a value
+# is its type tag: int, bool, str or Nil, with StringBuffer standing in for str
+# inside a variable. Unset variables hold None.
+NIL = Nil()
+# marks a frame slot whose variable has not been defined by DEFVAR yet
+UNDEFINED = object()
+TYPE_NAMES = {int: "int", bool: "bool", str: "string", StringBuffer: "string", Nil: "nil"}
+ESCAPE_SEQUENCE = re.compile(r"\\(\d{3})")
 
 class Variable:
+    __slots__ = ("value", "name")
+
     def __init__(self, name):
         self.value = None
         self.name = name
 
 class Argument:
+    __slots__ = ("isVar", "frame", "value", "slot", "type", "text")
+
     def __init__(self, argtype, text):
-        if argtype.upper() == "VAR":
+        self.isVar = argtype.upper() == "VAR"
+        if self.isVar:
             frame_value = text.split("@")
             self.frame = frame_value[0]
             self.value = Variable(name=frame_value[1])
         else:
             self.frame = None
-            self.value = None
+            self.value = self.parseLiteral(argtype, text)
+        self.slot = None
         self.type = argtype
         self.text = text
 
+    @staticmethod
+    def parseLiteral(argtype, text):
+        argtype = argtype.upper()
+        if argtype == "INT":
+            try:
+                try:
+                    return int(text)
+                except ValueError:
+                    return int(text, 0)
+            except (ValueError, TypeError):
+                sys.stderr.write(f"Invalid int literal '{text}'")
+                sys.exit(32)
+        elif argtype == "BOOL":
+            if text == "true":
+                return True
+            elif text == "false":
+                return False
+            sys.stderr.write(f"Invalid bool literal '{text}'")
+            sys.exit(32)
+        elif argtype == "NIL":
+            if text != "nil":
+                sys.stderr.write(f"Invalid nil literal '{text}'")
+                sys.exit(32)
+            return NIL
+        elif argtype == "STRING":
+            if text == None:
+                return ""
+            return ESCAPE_SEQUENCE.sub(lambda match: chr(int(match.group(1))), text)
+        return text
+
+
+    @classmethod
+    def restore(cls, argtype, text, frame, value, slot):
+        # rebuilds an argument stored by ProgramCache without parsing it again
+        arg = cls.__new__(cls)
+        arg.isVar = frame != None
+        arg.frame = frame
+        if arg.isVar:
+            arg.value = Variable(name=value)
+        else:
+            # only nil literals are stored without a value
+            arg.value = NIL if value is None else value
+        arg.type = argtype
+        arg.text = text
+        arg.slot = slot
+        return arg
+
+    def store(self):
+        if self.isVar:
+            return (self.type, self.text, self.frame, self.value.name, self.slot)
+        return (self.type, self.text, None, None if self.value is NIL else self.value, self.slot)
 
     def checkArgType(self, type):
         return self.type.upper() == type
 
-    def checkSymb(self):
-        if self.type.upper() not in ["VAR", "STRING", "BOOL", "INT", "NIL"]:
-            return False
-        else:
-            return True
-
 class Instruction:
     def __init__(self, order, code):
         self.order = order
@@ -51,1182 +188,2178 @@ class Instruction:
     def checkProperArgs(self, count):
         return len(self.argdict) == count;
 
-class Interpreter:
-    def __init__(self, input):
-        self.input = input
-        self.instList = []
-        self.calls = list()
-        self.TF = None
-        self.GF = dict()
-        self.LF = list()
-        self.stack = list()
-        self.labels = dict()
+def readInstruction(inst, order_dict):
+    if inst.tag != 'instruction':
+        sys.stderr.write("Every element has to be 'instruction'")
+        sys.exit(32)
 
-    def getLabels(self):
-        for i in range(len(self.instList)):
-            instr = self.instList[i]
-            if instr.code == "LABEL":
-                if instr.argdict['arg1'].checkArgType("LABEL"):
-                    if instr.argdict['arg1'].text in self.labels.keys():
-                        sys.stderr.write("Multiple labels with a same name")
-                        sys.exit(52)
+    for c in inst.attrib:
+        if not c in ['opcode', 'order']:
+            sys.stderr.write("Unsupported attribute in XML structure")
+            sys.exit(32)
 
-                    self.labels.update({instr.argdict['arg1'].text: i})
-                else:
-                    sys.stderr.write(f"Instruction {instr.code} requires type label")
-                    sys.exit(53)
+    try:
+        new_inst = Instruction(inst.attrib['order'], inst.attrib['opcode'])
 
-    def setToFrame(self, variable, value=None, resultval=None):
-        if variable.frame == "GF":
-            if variable.value.name not in self.GF.keys():
-                sys.stderr.write("Variable doesn't exist")
-                sys.exit(54)
-
-            self.GF.update({variable.value.name: value.text if value != None else resultval})
-        elif variable.frame == "TF":
-            if self.TF == None:
-                sys.stderr.write("Frame doesn't exist")
-                sys.exit(55)
-            if variable.value.name not in self.TF.keys():
-                sys.stderr.write("Variable doesn't exist")
-                sys.exit(54)
-            self.TF.update({variable.value.name: value.text if value != None else resultval})
-        else:
-            if len(self.LF) == 0:
-                sys.stderr.write("Frame doesn't exist")
-                sys.exit(55)
-            
-            if variable.value.name not in self.LF[len(self.LF)-1].keys():
-                sys.stderr.write("Variable doesn't exist")
-                sys.exit(54)
-            self.LF[len(self.LF)-1].update({variable.value.name: value.text if value != None else resultval})
-            
-    def getFromFrame(self, variable):
-        if variable.frame == "GF":
-            if variable.value.name not in self.GF.keys():
-                sys.stderr.write("Variable doesn't exist")
-                sys.exit(54)
-            return self.GF.get(variable.value.name)
-        elif variable.frame == "TF":
-            if self.TF == None:
-                sys.stderr.write("Frame doesn't exist")
-                sys.exit(55)
-            if variable.value.name not in self.TF.keys():
-                sys.stderr.write("Variable doesn't exist")
-                sys.exit(54)
-            return self.TF.get(variable.value.name)
-        elif variable.frame == "LF":
-            if len(self.LF) == 0:
-                sys.stderr.write("Frame doesn't exist")
-                sys.exit(55)
-    
-            if variable.value.name not in self.LF[len(self.LF)-1].keys():
-                sys.stderr.write("Variable doesn't exist")
-                sys.exit(54)
-            else:
-                value = self.LF[len(self.LF)-1].get(variable.value.name)
-            return value
-    def interpretInst(self):
-        self.sortlist()
-        self.getLabels()
-        i = 0
-        while i < (len(self.instList)):
-            instr = self.instList[i]
-            #print(instr.code)
-            if len(instr.argdict) == 0:
-                i = self.interpretZero(instr, i)
-            elif len(instr.argdict) == 1:
-                i = self.interpretOne(instr, i)
-            elif len(instr.argdict) == 2:
-                i = self.interpretTwo(instr, i)
-            elif len(instr.argdict) == 3:
-                i = self.interpretThree(instr, i)
-            else:
-                sys.stderr.write("Wrong number of arguments")
-                sys.exit(32)
-            i += 1
-    def intConversion(self, op):
-        if( op == None):
-            sys.stderr.write("Value error, variable is unset")
-            sys.exit(56)
+    except Exception as ex:
+        sys.stderr.write("Order or opcode is missing")
+        sys.exit(32)
+
+    if inst.attrib['order'] in order_dict:
+        sys.stderr.write("Duplicate 'Order' attribute in XML")
+        sys.exit(32)
+    else:
+        order_dict.update({inst.attrib['order'] : inst.attrib['opcode']})
+
+    if not new_inst.code in Interpreter.OPCODES:
+        sys.stderr.write("Neznámá nebo špatně zapsaná instrukce")
+        sys.exit(32)
+
+    for c in inst:
+        if len(c.attrib) != 1:
+            sys.stderr.write("Argument have more than 'type' ")
+            sys.exit(32)
         try:
-            op = int(op)
-        except ValueError as e:
-            sys.stderr.write(f"Value error {e}")
-            sys.exit(53)
-        return op
-    def interpretZero(self, instruction, position):
-        if instruction.code == "RETURN":
-            if len(self.calls) == 0:
-                sys.stderr.write("Call for this return doesn't exist")
-                sys.exit(56)
-            
-            return self.calls.pop()
-        elif instruction.code == "CREATEFRAME":
-            self.TF = dict()
-            return position
-        elif instruction.code == "PUSHFRAME":
-            if self.TF == None:
-                sys.stderr.write("Frame doesn't exist")
-                sys.exit(55)
-            else:
-                newFrame = self.TF
-                self.LF.append(newFrame)
-                self.TF = None
-            return position
-        elif instruction.code == "POPFRAME":
-            if len(self.LF) == 0:
-                sys.stderr.write("Frame for pop doesn't exist")
-                sys.exit(55)
-            else:
-                self.TF = self.LF.pop()
-            return position
-        elif instruction.code == "BREAK":
-            sys.stderr.write(f"Instruction order: {instruction.order}, actual position: {position}\nFrames - GF: {self.GF}\nTF: {self.TF}\nLF: {self.TF}")
-            pass
-        else:
-            sys.stderr.write("Wrong number of arguments")
+            try:
+                new_arg = Argument(c.attrib['type'], c.text.strip())
+            except:
+                new_arg = Argument(c.attrib['type'], c.text)
+        except Exception as ex:
+            sys.stderr.write("Argument doesn't have type attribute")
             sys.exit(32)
 
-    def interpretOne(self, instruction, position):
-        if not 'arg1' in instruction.argdict:
-            sys.stderr.write("Cannot interpret instruction without first argument 'arg1' ")
-            sys.exit(32)
-        arg1 = instruction.argdict['arg1']
+        new_inst.addArgument(c.tag, new_arg)
 
-        if instruction.code == "DEFVAR":
-            if not arg1.checkArgType("VAR"):
-                sys.stderr.write(f"Instruction {instruction.code} requires type var")
-                sys.exit(53)
+    return new_inst
 
-            if arg1.frame == "GF":
-                if arg1.value.name in self.GF.keys():
-                    sys.stderr.write("Cannot redefine a variable")
-                    sys.exit(52)
-                self.GF.update({arg1.value.name: None})
-            elif arg1.frame == "TF":
-                if self.TF == None:
-                    sys.stderr.write("Frame doesn't exist")
-                    sys.exit(55)
-                if arg1.value.name in self.TF.keys():
-                    sys.stderr.write("Cannot redefine a variable")
-                    sys.exit(52)
-                self.TF.update({arg1.value.name: None})
-            elif arg1.frame == "LF":
-                if len(self.LF) == 0:
-                    sys.stderr.write("No frames on stack")
-                    sys.exit(55)                
-                if arg1.value.name in self.LF[len(self.LF)-1]:
-                    sys.stderr.write("Cannot redefine a variable")
-                    sys.exit(52)
-                self.LF[len(self.LF)-1].update({arg1.value.name: None})
+def loadProgram(source, program):
+    # Streams the program with iterparse: every <instruction> is validated and
+    # decoded into the program when its end tag is read and then dropped
+    # from the tree, so the DOM is never built. Structural errors are held
+    # back until the whole document is read, because a malformed document has
+    # to end with 31 even when an earlier instruction is invalid.
+    root = None
+    depth = 0
+    error = None
+    order_dict = {}
+    try:
+        for event, element in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                    try:
+                        checkHeader(root)
+                    except SystemExit as e:
+                        error = e
+                continue
+
+            depth -= 1
+            if depth != 1 or error is not None:
+                continue
+            try:
+                program.addInstruction(readInstruction(element, order_dict))
+            except SystemExit as e:
+                error = e
+            root.clear()
+    except ET.ParseError as e:
+        sys.stderr.write("Error parsing XML")
+        sys.exit(31)
+    except OSError as e:
+        sys.stderr.write(f"Cannot open source file: {e}")
+        sys.exit(11)
+
+    if error is not None:
+        raise error
+
+def checkHeader(root):
+    if root.tag != 'program':
+        sys.stderr.write("Missing header 'program' in XML")
+        sys.exit(32)
 
-            return position
+    if not 'language' in root.attrib.keys():
+        sys.stderr.write("Not specified language in header of XML")
+        sys.exit(32)
 
-        elif instruction.code == "LABEL":
-            return position
+    for atr in root.attrib.keys():
+        if not atr in ['language', 'name', 'description']:
+            sys.stderr.write("Unsupported attributes in header of XML")
+            sys.exit(32)
 
-        elif instruction.code == "PUSHS":
-            if not arg1.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of argument")
-                sys.exit(32)
-            if arg1.checkArgType("VAR"):
-                value = self.getFromFrame(arg1)
-                if value == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            else:
-                value = arg1.text
-            
-            self.stack.append(value)
-            return position
-        elif instruction.code == "POPS":
-            if not arg1.checkArgType("VAR"):
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of argument")
-                sys.exit(32)
-            try:
-                stack_var = self.stack.pop()
-            except Exception as e:
-                sys.stderr.write("There's no value to be popped")
-                sys.exit(56)
+    if root.attrib['language'].upper() != 'IPPCODE23':
+        sys.stderr.write("Language not supported by this interpret")
+        sys.exit(32)
 
-            self.setToFrame(variable=arg1, resultval=stack_var)
-            return position
-        elif instruction.code == "CALL":
-            if not arg1.checkArgType("LABEL"):
-                sys.stderr.write(f"Instruction {instruction.code} require type label")
-                sys.exit(53)
-            self.calls.append(position)
+class OutputBuffer:
+    # Collects WRITE output in memory and hands it to the stream in large
+    # chunks; a size of 0 writes every piece through immediately.
+    DEFAULT_SIZE = 64 * 1024
+
+    def __init__(self, stream, size=DEFAULT_SIZE):
+        self.stream = stream
+        self.size = size
+        self.parts = []
+        self.pending = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.stream.write("".join(self.parts))
+            self.parts.clear()
+            self.pending = 0
+        self.stream.flush()
+
+class InputReader:
+    # Hands out the lines of the input stream one by one for READ without
+    # loading the whole stream into memory.
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readLine(self):
+        line = self.stream.readline()
+        if line == "":
+            return None
+        if line.endswith("\n"):
+            return line[:-1]
+        return line
+
+class ProgramCache:
+    # Keeps the decoded, sorted and slot-resolved program in a marshal file
+    # named after the SHA-256 of the source XML, so a warm start skips the
+    # XML parsing and validation entirely.
+    VERSION = 2
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def defaultDirectory():
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(base, "ippcode23")
+
+    @staticmethod
+    def key(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def fileKey(stream, chunkSize=1 << 16):
+        # same key as key() without holding the whole source in memory
+        digest = hashlib.sha256()
+        while chunk := stream.read(chunkSize):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".ippc")
+
+    @classmethod
+    def pack(cls, program):
+        instructions = [(instr.order, instr.code, tuple(arg.store() for arg in instr.args))
+                        for instr in program.instructions]
+        return (cls.VERSION, program.globalSlots, program.localSlots, instructions)
+
+    @classmethod
+    def unpack(cls, packed, program):
+        version, globalSlots, localSlots, instructions = packed
+        if version != cls.VERSION:
+            return False
 
-            if arg1.text in self.labels:
-                value = self.labels[arg1.text]
-            else:
-                sys.stderr.write("Non-existent Label")
-                sys.exit(52)
-            
-            return value
+        # a damaged entry may fail halfway, the program is only filled in
+        # once all instructions were restored
+        restored = [DecodedInstruction(order, code, getattr(Interpreter, Interpreter.OPCODES[code][0]),
+                                       tuple(Argument.restore(*arg) for arg in args))
+                    for order, code, args in instructions]
+        program.setSlots(globalSlots, localSlots)
+        program.instructions.extend(restored)
+        program.prepared = True
+        return True
+
+    def load(self, key, program):
+        try:
+            with open(self.path(key), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    packed = marshal.loads(data)
+            return self.unpack(packed, program)
+        except (OSError, ValueError, EOFError, TypeError, KeyError):
+            return False
 
-        elif instruction.code == "WRITE":
-            if arg1.checkArgType("VAR"):
-                string = self.getFromFrame(arg1)
-                if string == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if string == "nil":
-                    print("",end="")
-                else:
-                    print(string,end="")
-                return position
-            else:
-                if arg1.checkArgType("NIL"):
-                    print("", end="")
-                    return position
-                elif arg1.checkArgType("BOOL"):
-                    if arg1.text.upper() == 'TRUE':
-                        string = "true"
-                    else:
-                        string = "false"
-                else:
-                    string = arg1.text
+    def store(self, key, program):
+        self.write(self.path(key), marshal.dumps(self.pack(program)))
+
+    def codePath(self, name):
+        return os.path.join(self.directory, name + ".pyc")
+
+    def loadCode(self, name):
+        # translated programs are only valid for the same Python version and
+        # the same version of the translation
+        try:
+            with open(self.codePath(name), "rb") as f:
+                magic, version, code = marshal.load(f)
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+        if magic != importlib.util.MAGIC_NUMBER or version != PythonCompiler.VERSION:
+            return None
+        return code
+
+    def storeCode(self, name, code):
+        self.write(self.codePath(name), marshal.dumps((importlib.util.MAGIC_NUMBER, PythonCompiler.VERSION, code)))
+
+    def write(self, path, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temporary = f"{path}.{os.getpid()}"
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except OSError:
+            # the cache is only an optimization, an unwritable directory is not an error
+            pass
 
-            string = string.replace('\\032', ' ')
-            string = string.replace('\\092', ' \\')
-            string = string.replace('\\010', '\n')
-            string = string.replace('\\035', '#')
-            print(string,end="")
+class ExecutionLimits:
+    # Budgets of a run for --max-instructions, --max-time and --max-memory.
+    # The interpreter only compares its instruction count with a budget at
+    # backward jumps, returns and calls, which every endless loop or recursion
+    # passes. Time and memory are watched by a thread that drops the budget
+    # when they run out. A run over its budget ends with EXIT_CODE and a line
+    # with what it used on stderr.
+    # The memory limit caps the resident memory of the whole process, so it
+    # only means something for a run that has the process to itself: the
+    # server rejects it and Program.run refuses to overlap such a run with
+    # other runs.
+    EXIT_CODE = 60
+    # seconds between two checks of the watching thread
+    WATCH_INTERVAL = 0.01
+
+    # Program.run calls in progress and whether one of them has a memory limit
+    runLock = threading.Lock()
+    running = 0
+    exclusive = False
+
+    def __init__(self, instructions=None, seconds=None, megabytes=None):
+        self.instructions = instructions
+        self.seconds = seconds
+        self.megabytes = megabytes
+
+    @classmethod
+    def enter(cls, limits):
+        with cls.runLock:
+            memory = limits != None and limits.megabytes != None
+            if cls.exclusive or (memory and cls.running):
+                return False
+            cls.running += 1
+            cls.exclusive = memory
+            return True
 
-            return position
+    @classmethod
+    def leave(cls):
+        with cls.runLock:
+            cls.running -= 1
+            cls.exclusive = False
 
-        elif instruction.code == "JUMP":
-            if not arg1.checkArgType("LABEL"):
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of argument")
-                sys.exit(32)
-            if arg1.text in self.labels.keys():
-                return self.labels[arg1.text]
-            else:
-                sys.stderr.write("Non-existent Label")
-                sys.exit(52)
-        elif instruction.code == "EXIT":
-            if not arg1.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of argument")
-                sys.exit(32)
-            if arg1.checkArgType("VAR"):
-                code = self.getFromFrame(arg1)
-            elif arg1.checkArgType("INT"):
-                code = arg1.text
-            else:
-                sys.stderr.write("Cannot exit with this type")
-                sys.exit(53)
-            
-            code = self.intConversion(code)
-            if code <= 49 and code >= 0:
-                sys.exit(code)
+    @staticmethod
+    def residentMemory():
+        # resident memory of the process in bytes, the peak where /proc is missing
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def watch(self, interpreter, stopped):
+        while not stopped.wait(self.WATCH_INTERVAL):
+            if self.seconds != None and time.perf_counter() - interpreter.started > self.seconds:
+                interpreter.exceeded = "time"
+            elif self.megabytes != None and self.residentMemory() > self.megabytes * 1024 * 1024:
+                interpreter.exceeded = "memory"
             else:
-                sys.stderr.write("Cannot exit with this exit code")
-                sys.exit(57)
+                continue
+            # the next checkpoint of the run finds its budget used up
+            interpreter.budget = -1
+            return
+
+    def describe(self, limit):
+        if limit == "instructions":
+            return f"{self.instructions} instructions"
+        elif limit == "time":
+            return f"{self.seconds} s"
+        return f"{self.megabytes} MB"
+
+class SamplingProfiler:
+    # Samples the running program on SIGPROF: the handler walks up from the
+    # interrupted Python frame to the main loop, reads its current position and
+    # records it with the innermost calls of interpreter.calls. Names are only
+    # resolved when writing, each sample becomes the called functions plus the
+    # enclosing LABEL region and instruction, in collapsed-stack format.
+    MAX_DEPTH = 64
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = {}
+        self.interpreter = None
+        self.busy = False
+
+    def start(self, interpreter):
+        self.interpreter = interpreter
+        self.loops = (Interpreter.execute.__code__, Interpreter.executeWithStats.__code__)
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def sample(self, signum, frame):
+        if self.busy:
+            return
+        self.busy = True
+        try:
+            while frame is not None and not frame.f_code in self.loops:
+                frame = frame.f_back
+            if frame is None:
+                return
+            position = frame.f_locals.get("position")
+            if position is None or position >= len(self.interpreter.instructions):
+                return
+            calls = self.interpreter.calls
+            key = (len(calls) > self.MAX_DEPTH, tuple(calls[-self.MAX_DEPTH:]), position)
+            self.samples[key] = self.samples.get(key, 0) + 1
+        finally:
+            self.busy = False
+
+    def collapse(self):
+        program = self.interpreter.instructions
+        regions = []
+        region = "main"
+        for instr in program:
+            if instr.code == "LABEL":
+                region = instr.args[0].text
+            regions.append(region)
+
+        stacks = {}
+        for (truncated, calls, position), count in self.samples.items():
+            stack = ["main", "..."] if truncated else ["main"]
+            stack.extend(program[call].args[0].text for call in calls)
+            if regions[position] != stack[-1]:
+                stack.append(regions[position])
+            stack.append(f"{program[position].code}@{program[position].order}")
+            key = ";".join(stack)
+            stacks[key] = stacks.get(key, 0) + count
+        return stacks
+
+    def write(self, path):
+        try:
+            with open(path, "w") as f:
+                for stack, count in sorted(self.collapse().items()):
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            sys.stderr.write(f"Cannot write profile: {e}")
+            sys.exit(12)
+
+# decoded programs of a server worker process, by source hash
+WORKER_PROGRAMS = {}
+WORKER_PROGRAMS_LIMIT = 256
+
+def serveRequest(request, cacheDir):
+    # Runs one request of InterpreterServer inside a worker process.
+    data = None
+    for name in ("source", "hash", "input"):
+        if request.get(name) != None and type(request[name]) != str:
+            return {"error": f"Request field '{name}' has to be a string"}
+    key = request.get("hash")
+    if request.get("source") != None:
+        data = request["source"].encode()
+        key = ProgramCache.key(data)
+    if key == None:
+        return {"error": "Request needs 'source' or 'hash'"}
+    # the hash names a file in the cache directory
+    if not re.fullmatch("[0-9a-f]{64}", key):
+        return {"error": "Invalid hash"}
+
+    optimize = bool(request.get("optimize"))
+    limits = None
+    # a worker holds many programs, its memory says nothing about one run
+    if request.get("max_memory") != None:
+        return {"hash": key, "error": "The server does not support max_memory"}
+    values = [request.get(name) for name in ("max_instructions", "max_time")]
+    if any(value != None for value in values):
+        if not all(value == None or (type(value) in (int, float) and value > 0) for value in values):
+            return {"hash": key, "error": "Limits have to be positive numbers"}
+        limits = ExecutionLimits(*values)
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    program = WORKER_PROGRAMS.get((key, optimize))
+    if program == None:
+        cache = ProgramCache(cacheDir) if cacheDir else None
+        program = Program()
+        saved = sys.stderr
+        sys.stderr = stderr
+        try:
+            if not (cache and cache.load(key, program)):
+                if data == None:
+                    return {"hash": key, "error": "Unknown program hash"}
+                loadProgram(io.BytesIO(data), program)
+                program.prepare()
+                if cache:
+                    cache.store(key, program)
+            program.finish(optimize)
+        except SystemExit as e:
+            return {"hash": key, "stdout": "", "stderr": stderr.getvalue(), "exit_code": e.code}
+        finally:
+            sys.stderr = saved
+        if len(WORKER_PROGRAMS) >= WORKER_PROGRAMS_LIMIT:
+            WORKER_PROGRAMS.pop(next(iter(WORKER_PROGRAMS)))
+        WORKER_PROGRAMS[(key, optimize)] = program
+
+    result = program.run(request.get("input") or "", stdout, stderr, limits=limits)
+    return {"hash": key, "stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "exit_code": result.exitCode}
+
+def initServerWorker():
+    # forked workers inherit the signal wakeup descriptor of the server's
+    # event loop, a signal sent to a worker would otherwise reach the server
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+class InterpreterServer:
+    # Keeps warm interpreter processes behind a Unix socket. A client sends one
+    # JSON object per line, {"source": "<xml>"} or {"hash": "<sha256 of xml>"}
+    # with optional "input", "optimize", "max_instructions" and "max_time",
+    # and reads back one line with
+    # "hash", "stdout", "stderr" and "exit_code" (or "error").
+    # longest request line, sources are sent inline and reach megabytes
+    LINE_LIMIT = 64 * 1024 * 1024
+
+    def __init__(self, path, cacheDir, jobs):
+        self.path = path
+        self.cacheDir = cacheDir
+        self.jobs = jobs
+
+    def serve(self):
+        # a stale socket of a previous server is replaced, anything else at
+        # the path is left alone
+        if os.path.lexists(self.path) and not self.isSocket():
+            sys.stderr.write(f"Cannot create socket: {self.path} exists and is not a socket")
+            sys.exit(12)
+        if os.path.lexists(self.path):
+            os.unlink(self.path)
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.isSocket():
+                os.unlink(self.path)
 
-        elif instruction.code == "DPRINT":
-            if not arg1.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of argument")
-                sys.exit(32)
-            if arg1.checkArgType("VAR"):
-                dprint = self.getFromFrame(arg1)
-                sys.stderr.write(dprint)
-            return position
-        else:
-            sys.stderr.write("Wrong number of arguments")
-            sys.exit(32)
+    def isSocket(self):
+        try:
+            return stat.S_ISSOCK(os.lstat(self.path).st_mode)
+        except OSError:
+            return False
 
-    def interpretTwo(self, instruction, position):
-        arg1 = instruction.argdict['arg1']
-        arg2 = instruction.argdict['arg2']
-        if instruction.code == "READ":
-            if not arg1.checkArgType("VAR") or not arg2.checkArgType("TYPE"):
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of arguments")
-                sys.exit(32)
-            
-            value = ""      
-            for i, item in enumerate(self.input):
-                if arg2.text == "bool":
-                    if item.strip().upper() == "TRUE" or item.strip().upper() == "FALSE":
-                        value = item.strip().lower()
-                        self.input.pop(i)
-                    else:
-                        value = "false"
-                        self.input.pop(i)
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        loop.add_signal_handler(signal.SIGTERM, lambda: stop.done() or stop.set_result(None))
+        self.pool = self.newPool()
+        try:
+            server = await asyncio.start_unix_server(self.handle, path=self.path, limit=self.LINE_LIMIT)
+            async with server:
+                await stop
+        finally:
+            self.pool.shutdown()
+
+    def newPool(self):
+        return ProcessPoolExecutor(self.jobs, initializer=initServerWorker)
+
+    async def execute(self, request):
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            return await loop.run_in_executor(pool, serveRequest, request, self.cacheDir)
+        except BrokenProcessPool:
+            # a worker was killed (out of memory, a signal, a crash), which
+            # breaks the whole pool, later requests get a fresh one; the lost
+            # request is not retried, it may be what killed the worker
+            if self.pool is pool:
+                self.pool = self.newPool()
+                pool.shutdown(wait=False)
+            return {"error": "Worker process died while running the request"}
+        except Exception as e:
+            return {"error": f"Request failed: {e!r}"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # the rest of an overlong line cannot be told apart from
+                    # the next request, so the connection ends after the reply
+                    writer.write(json.dumps({"error": f"Request is longer than {self.LINE_LIMIT} bytes"}).encode() + b"\n")
+                    await writer.drain()
                     break
-                elif arg2.text == "int":
-                    try:
-                        value = int(item.strip())
-                        self.input.pop(i)
-                        break
-                    except ValueError:
-                        value = "nil"
-                        self.input.pop(i)
-                        break
-                elif arg2.text == "string":
-                    value = item.strip()
-                    self.input.pop(i)
+                if not line:
                     break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request has to be an object")
+                except ValueError as e:
+                    response = {"error": f"Invalid request: {e}"}
                 else:
-                    value = "nil"
-                    self.input.pop(i)
-                    break
-            
-            self.setToFrame(variable=arg1, resultval=value)
-                
-            return position
-        elif instruction.code == "INT2CHAR":
-            if not arg1.checkArgType("VAR") and not arg2.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of arguments")
-                sys.exit(32)
-
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            else:
-                op1 = arg2.text
+                    response = await self.execute(request)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
 
-            op1 = self.intConversion(op1)
-            
-            try:
-                op1 = chr(op1)
-            except ValueError as e:
-                sys.stderr.write("Value cannot be converted to char")
-                sys.exit(58)
+# program shared with the forked batch workers
+BATCH_PROGRAM = None
 
-            self.setToFrame(variable=arg1, resultval=op1)
+def batchInputs(pattern):
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+def batchNames(inputs):
+    # Results are named after the input without its extension, inputs that
+    # would share that name (x.in and x.txt) keep the whole file name. None
+    # if two inputs have the same file name in different directories.
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in inputs]
+    counts = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+    names = [stem if counts[stem] == 1 else os.path.basename(path) for path, stem in zip(inputs, stems)]
+    if len(set(names)) != len(names):
+        return None
+    return names
+
+def runBatchInput(path, name, outputDir, limits):
+    # Runs in a forked worker, the program was loaded by the parent process.
+    stderr = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with open(path, "r") as stream, open(os.path.join(outputDir, name + ".out"), "w") as stdout:
+            code = BATCH_PROGRAM.run(stream, stdout, stderr, limits=limits).exitCode
+    except OSError as e:
+        stderr.write(f"Cannot open input file: {e}")
+        code = 11
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(outputDir, name + ".rc"), "w") as f:
+        f.write(f"{code}\n")
+    entry = {"input": path, "name": name, "exit_code": code, "time": elapsed}
+    if stderr.getvalue():
+        with open(os.path.join(outputDir, name + ".err"), "w") as f:
+            f.write(stderr.getvalue())
+        entry["stderr"] = name + ".err"
+    return entry
+
+def runBatch(program, inputs, names, outputDir, jobs, limits=None):
+    # Every input gets NAME.out and NAME.rc (and NAME.err if anything was
+    # written to stderr) in outputDir, manifest.json lists all of them.
+    global BATCH_PROGRAM
+    BATCH_PROGRAM = program
+    try:
+        os.makedirs(outputDir, exist_ok=True)
+    except OSError as e:
+        sys.stderr.write(f"Cannot create output directory: {e}")
+        sys.exit(12)
+
+    # objects that exist now are left alone by the collector, so the forked
+    # workers keep sharing the pages of the decoded program
+    gc.freeze()
+    start = time.perf_counter()
+    with multiprocessing.get_context("fork").Pool(jobs) as pool:
+        entries = pool.starmap(runBatchInput, [(path, name, outputDir, limits)
+                                               for path, name in zip(inputs, names)], chunksize=1)
+    manifest = {
+        "inputs": len(entries),
+        "failed": sum(entry["exit_code"] != 0 for entry in entries),
+        "jobs": jobs,
+        "wall_time": time.perf_counter() - start,
+        "results": entries,
+    }
+    try:
+        with open(os.path.join(outputDir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+    except OSError as e:
+        sys.stderr.write(f"Cannot write manifest: {e}")
+        sys.exit(12)
+
+class DecodedInstruction:
+    __slots__ = ("order", "code", "handler", "args")
+
+    def __init__(self, order, code, handler, args):
+        self.order = order
+        self.code = code
+        self.handler = handler
+        self.args = args
+
+class Program:
+    # The decoded program: sorted instructions with resolved variable slots and
+    # linked labels. All state of a run lives in Interpreter, so one finished
+    # Program can be run many times, also from several threads at once.
+
+    # comparisons fused with a following JUMPIFEQ/JUMPIFNEQ on their result
+    COMPARE_JUMPS = {"LT": "instLtJump", "GT": "instGtJump", "EQ": "instEqJump"}
+    TYPED_COMPARE_JUMPS = {"LT": "instLtJumpTyped", "GT": "instGtJumpTyped", "EQ": "instEqJumpTyped"}
+
+    def __init__(self):
+        self.instructions = []
+        self.labels = {}
+        self.globalSlots = {}
+        self.localSlots = {}
+        self.emptyFrame = []
+        self.fusions = {}
+        self.simplifications = {}
+        self.prepared = False
+        self.optimized = False
+        self.compiledRun = None
 
-            return position
-        elif instruction.code == "STRLEN":
-            if not arg1.checkArgType("VAR") and not arg2.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of arguments")
-                sys.exit(32)
-            
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op1 == "nil":
-                    sys.stderr.write("Cannot use Strlen on different type than string")
-                    sys.exit(53)
-                else:
-                    try:
-                        int(op1)
-                        sys.stderr.write("Cannot use Strlen on different type than string")
-                        sys.exit(53)
-                    except ValueError:
-                        try:
-                            if op1.upper() == "TRUE" or op1.upper() == "FALSE":
-                                sys.stderr.write("Cannot use Strlen on different type than string")
-                                sys.exit(53)
-                        except ValueError:
-                            pass
-            elif arg2.checkArgType("STRING"):
-                op1 = arg2.text
-            else:
-                sys.stderr.write("Cannot use Strlen on different type than string")
-                sys.exit(53)
-            
-            try:
-                result = len(op1)
-            except TypeError as e:
-                result = 0
+    def getLabels(self):
+        for i in range(len(self.instructions)):
+            instr = self.instructions[i]
+            if instr.code == "LABEL":
+                if instr.args[0].text in self.labels.keys():
+                    sys.stderr.write("Multiple labels with a same name")
+                    sys.exit(52)
 
-            self.setToFrame(arg1, resultval=result)
-            return position
+                self.labels.update({instr.args[0].text: i})
 
-        elif instruction.code == "TYPE":
-            if not arg1.checkArgType("VAR") and not arg2.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of arguments")
-                sys.exit(32)
+    def linkLabels(self):
+        # label operands of jumps and calls are replaced by the position of
+        # their LABEL, so no label name is looked up while running
+        for instr in self.instructions:
+            if instr.code == "LABEL":
+                continue
+            for arg in instr.args:
+                if isinstance(arg, Argument) and arg.checkArgType("LABEL"):
+                    if not arg.text in self.labels:
+                        sys.stderr.write(f"Non-existent Label '{arg.text}'")
+                        sys.exit(52)
+                    arg.value = self.labels[arg.text]
+
+    @staticmethod
+    def sameVariable(arg1, arg2):
+        return arg1.isVar and arg2.isVar and arg1.frame == arg2.frame and arg1.value.name == arg2.value.name
+
+    def fuse(self, first, second):
+        # Returns the superinstruction replacing the pair, or None.
+        pair = (first.code, second.code)
+        if pair == ("CREATEFRAME", "PUSHFRAME"):
+            return DecodedInstruction(first.order, "CREATEFRAME+PUSHFRAME", Interpreter.instCreatePushFrame, ())
+        elif pair == ("DEFVAR", "MOVE"):
+            var, symb = second.args
+            if self.sameVariable(first.args[0], var):
+                return DecodedInstruction(first.order, "DEFVAR+MOVE", Interpreter.instDefvarMove, (var, symb))
+        elif pair == ("PUSHS", "POPS"):
+            symb, var = first.args[0], second.args[0]
+            return DecodedInstruction(first.order, "PUSHS+POPS", Interpreter.instMove, (var, symb))
+        elif first.code in self.COMPARE_JUMPS and second.code in ("JUMPIFEQ", "JUMPIFNEQ"):
+            var, op1, op2 = first.args
+            label, cond1, cond2 = second.args
+            if self.sameVariable(var, cond1) and cond2.checkArgType("BOOL"):
+                expected = cond2.value
+            elif self.sameVariable(var, cond2) and cond1.checkArgType("BOOL"):
+                expected = cond1.value
+            else:
+                return None
+            # the comparison result that makes the second instruction jump
+            jumpWhen = expected if second.code == "JUMPIFEQ" else not expected
+            # a comparison specialized by type inference keeps skipping its checks
+            typed = first.handler is getattr(Interpreter, ControlFlowGraph.TYPED[first.code][0])
+            handler = (self.TYPED_COMPARE_JUMPS if typed else self.COMPARE_JUMPS)[first.code]
+            return DecodedInstruction(first.order, f"{first.code}+{second.code}",
+                                      getattr(Interpreter, handler), (first, label, jumpWhen))
+        return None
+
+    def fuseInstructions(self):
+        fused = []
+        counts = {}
+        i = 0
+        while i < len(self.instructions):
+            instr = self.instructions[i]
+            if i + 1 < len(self.instructions):
+                superInstr = self.fuse(instr, self.instructions[i + 1])
+                if superInstr != None:
+                    counts[superInstr.code] = counts.get(superInstr.code, 0) + 1
+                    fused.append(superInstr)
+                    i += 2
+                    continue
+            fused.append(instr)
+            i += 1
+        self.instructions = fused
+        self.fusions = counts
 
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    type1 = ""
-                if op1 == "nil":
-                    type1 = "nil"
+    def simplify(self):
+        # Labels are linked before anything is removed, so an undefined label
+        # used only in unreachable code is still reported.
+        self.getLabels()
+        self.linkLabels()
+        graph = ControlFlowGraph(self.instructions)
+        self.instructions = graph.simplify()
+        self.labels = {}
+        self.getLabels()
+        self.linkLabels()
+        # types are inferred on the simplified program, whose positions changed
+        typed = ControlFlowGraph(self.instructions)
+        self.instructions = typed.specialize()
+        graph.counts["specialized"] = typed.counts["specialized"]
+        self.simplifications = graph.counts
+        self.labels = {}
+
+    def simplifySummary(self):
+        counts = self.simplifications
+        return (f"Optimizer: removed {counts['blocks']} unreachable blocks ({counts['unreachable']} instructions), "
+                f"propagated {counts['constants']} constants, removed {counts['stores']} dead stores, "
+                f"specialized {counts['specialized']} instructions with inferred types\n")
+
+    def fusionSummary(self):
+        summary = ", ".join(f"{code} {count}" for code, count in sorted(self.fusions.items()))
+        return f"Optimizer: applied {sum(self.fusions.values())} fusions ({summary})\n"
+
+    def resolveVariables(self):
+        # every variable gets a fixed slot: GF names index the global frame,
+        # TF/LF names share one program-wide layout used by every local frame
+        self.globalSlots = {}
+        self.localSlots = {}
+        for instr in self.instructions:
+            for arg in instr.args:
+                if not arg.isVar:
+                    continue
+                if arg.frame == "GF":
+                    slots = self.globalSlots
+                elif arg.frame == "TF" or arg.frame == "LF":
+                    slots = self.localSlots
                 else:
-                    try:
-                        if op1 != None:
-                            int(op1)
-                            type1 = "int"
-                    except ValueError:
-                        type1 = 'string'
-                        try:
-                            if op1.upper() == "TRUE" or op1.upper() == "FALSE":
-                                type1 = 'bool'
-                        except ValueError:
-                            pass
-
-            else:
-                op1 = arg2.text
-                type1 = arg2.type
-            
-            
-            self.setToFrame(arg1, resultval=type1)
+                    sys.stderr.write(f"Unknown frame '{arg.frame}'")
+                    sys.exit(32)
+                arg.slot = slots.setdefault(arg.value.name, len(slots))
+        self.setSlots(self.globalSlots, self.localSlots)
 
-            return position
+    def setSlots(self, globalSlots, localSlots):
+        self.globalSlots = globalSlots
+        self.localSlots = localSlots
+        self.emptyFrame = [UNDEFINED] * len(localSlots)
 
-        elif instruction.code == "MOVE":
-            if not arg1.checkArgType("VAR") and not arg2.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of arguments")
+    def prepare(self):
+        self.sortlist()
+        self.resolveVariables()
+        self.prepared = True
+
+    def finish(self, optimize=False):
+        # last step of loading, afterwards the program is only read by its runs
+        if not self.prepared:
+            self.prepare()
+        if optimize:
+            self.simplify()
+            self.fuseInstructions()
+        self.optimized = optimize
+        self.getLabels()
+        self.linkLabels()
+        self.instructions = tuple(self.instructions)
+
+    def compileToPython(self, cache=None, key=None):
+        # translates the finished program with PythonCompiler, the code object
+        # is kept in the program cache next to the decoded program
+        name = f"{key}.opt" if self.optimized else key
+        code = cache.loadCode(name) if cache else None
+        if code == None:
+            code = compile(PythonCompiler(self).source(), f"<IPPcode23 {key or 'program'}>", "exec")
+            if cache:
+                cache.storeCode(name, code)
+        namespace = {
+            "I": self.instructions,
+            "H": tuple(instr.handler for instr in self.instructions),
+            "UNDEFINED": UNDEFINED,
+            "NIL": NIL,
+            "PLAIN": PythonCompiler.PLAIN,
+            "ORDERED": PythonCompiler.ORDERED,
+            "fmt": Interpreter.formatValue,
+        }
+        exec(code, namespace)
+        self.compiledRun = namespace["run"]
+
+    def run(self, input="", stdout=None, stderr=None, compiled=True, limits=None):
+        # Runs the program once with its own execution state. Input can be a
+        # string or a text stream, stdout and stderr default to new StringIO
+        # objects. Exit codes are returned instead of ending the process. A
+        # program translated by compileToPython runs its translation unless
+        # compiled is False. limits is an optional ExecutionLimits, a run with
+        # a memory limit cannot overlap other runs in the process (exit code 10).
+        if isinstance(input, str):
+            input = io.StringIO(input)
+        stdout = stdout if stdout != None else io.StringIO()
+        stderr = stderr if stderr != None else io.StringIO()
+        interpreter = Interpreter(self, InputReader(input), OutputBuffer(stdout), stderr)
+        if not compiled:
+            interpreter.compiledRun = None
+        interpreter.limits = limits
+        if not ExecutionLimits.enter(limits):
+            stderr.write("A run with a memory limit cannot overlap other runs, the limit counts the memory of the whole process")
+            return RunResult(10, stdout, stderr)
+        code = 0
+        try:
+            interpreter.interpretInst()
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code == None else 1)
+        finally:
+            ExecutionLimits.leave()
+        return RunResult(code, stdout, stderr)
+
+    def addInstruction(self, instr):
+        # all operand checks happen here, handlers rely on the kinds they get
+        handler, kinds = Interpreter.OPCODES[instr.code]
+        args = []
+        for i, kind in enumerate(kinds, 1):
+            if not f"arg{i}" in instr.argdict:
+                sys.stderr.write(f"Instruction {instr.code} requires {len(kinds)} arguments")
                 sys.exit(32)
-            
-            if arg2.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg2)
-                if op2 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                self.setToFrame(arg1, resultval=op2)
-            else:
-                self.setToFrame(arg1,arg2)
-
-            return position
-        elif instruction.code == "NOT":
-            if not arg1.checkArgType("VAR") and not arg2.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad type of arguments")
+            arg = instr.argdict[f"arg{i}"]
+            if not arg.type.lower() in Interpreter.OPERANDS[kind]:
+                sys.stderr.write(f"Argument {i} of instruction {instr.code} has to be {kind}, not {arg.type}")
                 sys.exit(32)
-            
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            #TODO dodělat do variable types které se přiřazují do proměnné buďto v rámci rámce nebo v rámci variable objektu
-            elif arg2.checkArgType("BOOL"):
-                op1 = arg2.text
-            else:
-                sys.stderr.write("Cannot use Not on different type than bool")
-                sys.exit(53)
-
-            if op1.upper() == "TRUE":
-                result = "false"
-            elif op1.upper() == "FALSE":
-                result = "true"
-            else:
-                sys.stderr.write("Cannot use Not on different type than bool")
-                sys.exit(53)
- 
-            self.setToFrame(arg1,resultval=str(result).lower())    
-
-            return position
-        else:
+            if kind == "type" and not arg.text in Interpreter.TYPES:
+                sys.stderr.write(f"Unknown type '{arg.text}' in instruction {instr.code}")
+                sys.exit(32)
+            args.append(arg)
+        if len(instr.argdict) != len(kinds):
             sys.stderr.write("Wrong number of arguments")
             sys.exit(32)
+        self.instructions.append(DecodedInstruction(instr.order, instr.code, getattr(Interpreter, handler), tuple(args)))
 
-    def interpretThree(self, instruction, position):
-        arg1 = instruction.argdict['arg1']
-        arg2 = instruction.argdict['arg2']
-        arg3 = instruction.argdict['arg3']
-        if instruction.code == "ADD":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
+    def sortlist(self):
+        def convertInstOrder( op ):
+            try:
+                op = int(op.lstrip('0'))
+            except ValueError:
+                raise ValueError("Order has to be number")
 
-            if arg2.checkArgType("VAR"):
-                op1 = self.intConversion(self.getFromFrame(arg2))
-            elif arg2.checkArgType("INT"):
-                op1 = self.intConversion(arg2.text)
-            else:
-                sys.stderr.write("Cannot use Add on diffent type than int")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.intConversion(self.getFromFrame(arg3))
-            elif arg3.checkArgType("INT"):
-                op2 = arg3.text
-                try:
-                    op2 = int(op2)
-                except ValueError as e:
-                    sys.stderr.write("Cannot use Add on different type than int")
-                    sys.exit(32)
-            else:
-                sys.stderr.write("Cannot use Add on diffent type than int")
-                sys.exit(53)
+            if op <= 0:
+                raise ValueError("Order has to be bigger than zero")
+            return op
 
-            result = op1 + op2
+        try:
+            self.instructions.sort(key=lambda instr: convertInstOrder(instr.order))
+        except ValueError as e:
+            sys.stderr.write(str(e))
+            sys.exit(32)
 
-            self.setToFrame(arg1, resultval=result)
+    def printList(self):
+        for item in self.instructions:
+            print(item.order + " " + item.code + "")
+            for i, argitem in enumerate(item.args):
+                print(f"arg{i+1} " + argitem.text)
+        exit(0)
 
-            return position
-        elif instruction.code == "SUB":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-            if arg2.checkArgType("VAR"):
-                op1 = self.intConversion(self.getFromFrame(arg2))
-            elif arg2.checkArgType("INT"):
-                op1 = self.intConversion(arg2.text)
-            else:
-                sys.stderr.write("Cannot use Sub on diffent type than int")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.intConversion(self.getFromFrame(arg3))
-            elif arg3.checkArgType("INT"):
-                op2 = self.intConversion(arg3.text)
+class RunResult:
+    def __init__(self, exitCode, stdout, stderr):
+        self.exitCode = exitCode
+        self.stdout = stdout
+        self.stderr = stderr
+
+class LoadError(Exception):
+    def __init__(self, exitCode, message):
+        super().__init__(message)
+        self.exitCode = exitCode
+        self.message = message
+
+class ControlFlowGraph:
+    # Basic blocks of a program with linked labels, used under --optimize to
+    # drop unreachable blocks, propagate constants stored by MOVE and remove
+    # MOVEs overwritten before being read. Only rewrites that keep the output,
+    # messages and exit codes of every run are made.
+    BRANCHES = ("JUMPIFEQ", "JUMPIFNEQ", "JUMPIFEQS", "JUMPIFNEQS", "CALL")
+    ENDS = ("JUMP", "RETURN", "EXIT") + BRANCHES
+    FRAME_CHANGES = ("CREATEFRAME", "PUSHFRAME", "POPFRAME")
+    # instructions whose first operand is read and not written
+    READERS = ("PUSHS", "WRITE", "EXIT", "DPRINT")
+    # positions of the operands read as symb, only these take constants
+    OPERANDS = {
+        "MOVE": (1,), "INT2CHAR": (1,), "STRLEN": (1,), "TYPE": (1,), "NOT": (1,),
+        "ADD": (1, 2), "SUB": (1, 2), "MUL": (1, 2), "IDIV": (1, 2), "LT": (1, 2), "GT": (1, 2), "EQ": (1, 2),
+        "AND": (1, 2), "OR": (1, 2), "STRI2INT": (1, 2), "CONCAT": (1, 2), "GETCHAR": (1, 2), "SETCHAR": (1, 2),
+        "JUMPIFEQ": (1, 2), "JUMPIFNEQ": (1, 2),
+        "PUSHS": (0,), "WRITE": (0,), "EXIT": (0,), "DPRINT": (0,),
+    }
+
+    # type of the value an instruction stores in its first operand, None when
+    # it is only known while running
+    RESULTS = {
+        "ADD": int, "SUB": int, "MUL": int, "IDIV": int, "STRLEN": int, "STRI2INT": int,
+        "LT": bool, "GT": bool, "EQ": bool, "AND": bool, "OR": bool, "NOT": bool,
+        "CONCAT": str, "GETCHAR": str, "INT2CHAR": str, "TYPE": str, "SETCHAR": str,
+        "MOVE": None, "READ": None, "POPS": None, "DEFVAR": None,
+    }
+    # opcode -> (handler without type checks, operand types it is used for)
+    TYPED = {
+        "ADD": ("instAddTyped", (int,)),
+        "SUB": ("instSubTyped", (int,)),
+        "MUL": ("instMulTyped", (int,)),
+        "IDIV": ("instIdivTyped", (int,)),
+        "LT": ("instLtTyped", (int, bool)),
+        "GT": ("instGtTyped", (int, bool)),
+        "EQ": ("instEqTyped", (int, bool)),
+        "CONCAT": ("instConcatTyped", (str,)),
+    }
+
+    def __init__(self, instructions):
+        self.instructions = instructions
+        self.blocks = []
+        self.successors = []
+        self.index = {}
+        self.counts = {"blocks": 0, "unreachable": 0, "constants": 0, "stores": 0, "specialized": 0}
+        self.build()
+
+    @staticmethod
+    def variable(arg):
+        return (arg.frame, arg.slot)
+
+    def build(self):
+        count = len(self.instructions)
+        starts = {0}
+        for position, instr in enumerate(self.instructions):
+            if instr.code == "LABEL":
+                starts.add(position)
+            elif instr.code in self.ENDS:
+                starts.add(position + 1)
+        starts = sorted(start for start in starts if start < count)
+        index = self.index
+        for i, start in enumerate(starts):
+            index[start] = i
+            self.blocks.append((start, starts[i + 1] if i + 1 < len(starts) else count))
+
+        for start, end in self.blocks:
+            last = self.instructions[end - 1]
+            targets = []
+            if last.code == "JUMP" or last.code in self.BRANCHES:
+                targets.append(last.args[0].value)
+                if last.code != "JUMP":
+                    targets.append(end)
+            elif last.code != "RETURN" and last.code != "EXIT":
+                targets.append(end)
+            # RETURN continues after a CALL, which is already a successor of it
+            self.successors.append([index[target] for target in targets if target < count])
+
+    def reachable(self):
+        seen = set()
+        pending = [0] if self.blocks else []
+        while pending:
+            block = pending.pop()
+            if not block in seen:
+                seen.add(block)
+                pending.extend(self.successors[block])
+        return seen
+
+    def simplify(self):
+        live = self.reachable()
+        result = []
+        for i, (start, end) in enumerate(self.blocks):
+            if i in live:
+                block = self.propagate(self.instructions[start:end])
+                result.extend(self.removeDeadStores(block))
             else:
-                sys.stderr.write("Cannot use Sub on diffent type than int")
-                sys.exit(53)
-
-            result = op1 - op2
-
-            self.setToFrame(arg1, resultval=result)
-
-            return position
-        elif instruction.code == "MUL":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-            if arg2.checkArgType("VAR"):
-                op1 = self.intConversion(self.getFromFrame(arg2))
-            elif arg2.checkArgType("INT"):
-                op1 = self.intConversion(arg2.text)
+                self.counts["blocks"] += 1
+                self.counts["unreachable"] += end - start
+        return result
+
+    def propagate(self, block):
+        # constants known to be stored in variables, only within the block
+        constants = {}
+        result = []
+        for instr in block:
+            args = list(instr.args)
+            for i in self.OPERANDS.get(instr.code, ()):
+                if args[i].isVar and self.variable(args[i]) in constants:
+                    args[i] = constants[self.variable(args[i])]
+                    self.counts["constants"] += 1
+            if args != list(instr.args):
+                instr = DecodedInstruction(instr.order, instr.code, instr.handler, tuple(args))
+
+            if instr.code in self.FRAME_CHANGES:
+                constants = {var: value for var, value in constants.items() if var[0] == "GF"}
+            elif instr.code in self.RESULTS:
+                constants.pop(self.variable(args[0]), None)
+                if instr.code == "MOVE" and not args[1].isVar:
+                    constants[self.variable(args[0])] = args[1]
+            result.append(instr)
+        return result
+
+    def removeDeadStores(self, block):
+        # A MOVE of a constant is dropped only when its variable is known to
+        # exist, so removing it cannot skip an error of the original program.
+        existing = set()
+        result = []
+        for position, instr in enumerate(block):
+            if instr.code in self.FRAME_CHANGES:
+                existing = {var for var in existing if var[0] == "GF"}
+            elif instr.code == "MOVE" and not instr.args[1].isVar and self.variable(instr.args[0]) in existing \
+                    and self.overwritten(block, position + 1, self.variable(instr.args[0])):
+                self.counts["stores"] += 1
+                continue
+            # an instruction that completed has accessed all its variables
+            existing.update(self.variable(arg) for arg in instr.args if arg.isVar)
+            result.append(instr)
+        return result
+
+    def overwritten(self, block, start, var):
+        for instr in block[start:]:
+            if instr.code == "BREAK" or (instr.code in self.FRAME_CHANGES and var[0] != "GF"):
+                return False
+            reads = instr.args if instr.code in self.READERS else instr.args[1:]
+            if any(arg.isVar and self.variable(arg) == var for arg in reads):
+                return False
+            if instr.args and instr.args[0].isVar and self.variable(instr.args[0]) == var:
+                return not instr.code in self.READERS and instr.code != "DEFVAR" and instr.code != "SETCHAR"
+        # the value may still be read by a following block
+        return False
+
+    def operandType(self, arg, state):
+        if arg.isVar:
+            return state.get(self.variable(arg))
+        return type(arg.value)
+
+    def transfer(self, instr, state):
+        # State after the instruction completed: variable -> type of its value,
+        # or None for a variable only known to exist. TF and LF facts follow
+        # the frames they describe.
+        code = instr.code
+        if code == "CREATEFRAME":
+            return {var: t for var, t in state.items() if var[0] != "TF"}
+        elif code == "PUSHFRAME":
+            return {("LF" if var[0] == "TF" else var[0], var[1]): t for var, t in state.items() if var[0] != "LF"}
+        elif code == "POPFRAME":
+            return {("TF" if var[0] == "LF" else var[0], var[1]): t for var, t in state.items() if var[0] != "TF"}
+
+        args = instr.args
+        written = args[0] if code in self.RESULTS else None
+        if code == "MOVE":
+            result = self.operandType(args[1], state)
+        elif written != None:
+            result = self.RESULTS[code]
+        # an instruction that completed has accessed all its variables
+        for arg in args:
+            if arg.isVar:
+                state.setdefault(self.variable(arg), None)
+        if written != None:
+            state[self.variable(written)] = result
+        return state
+
+    @staticmethod
+    def meet(first, second):
+        return {var: (t if second[var] == t else None) for var, t in first.items() if var in second}
+
+    def stableTypes(self):
+        # GF variable -> the type every store to it leaves there, None when the
+        # stores differ or one of them is only known while running
+        types = {}
+        for instr in self.instructions:
+            if not instr.code in self.RESULTS or instr.code == "DEFVAR" or instr.args[0].frame != "GF":
+                continue
+            if instr.code == "MOVE":
+                arg = instr.args[1]
+                result = None if arg.isVar else type(arg.value)
             else:
-                sys.stderr.write("Cannot use Mul on diffent type than int")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.intConversion(self.getFromFrame(arg3))
-            elif arg3.checkArgType("INT"):
-                op2 = self.intConversion(arg3.text)
+                result = self.RESULTS[instr.code]
+            var = self.variable(instr.args[0])
+            types[var] = result if types.get(var, result) == result else None
+        return types
+
+    def afterCall(self, state, stable):
+        # The callee may run anything before it returns. Global variables keep
+        # existing and keep a type that every store to them leaves; nothing is
+        # known about the frames.
+        return {var: (t if stable.get(var) == t else None) for var, t in state.items() if var[0] == "GF"}
+
+    def inferTypes(self):
+        # forward dataflow over the blocks, returns the state at each block start
+        stable = self.stableTypes()
+        count = len(self.instructions)
+        states = [None] * len(self.blocks)
+        pending = []
+        if self.blocks:
+            states[0] = {}
+            pending.append(0)
+        while pending:
+            block = pending.pop()
+            start, end = self.blocks[block]
+            state = dict(states[block])
+            for instr in self.instructions[start:end]:
+                state = self.transfer(instr, state)
+
+            last = self.instructions[end - 1]
+            if last.code == "CALL":
+                edges = [(self.index[last.args[0].value], state)]
+                if end < count:
+                    edges.append((self.index[end], self.afterCall(state, stable)))
             else:
-                sys.stderr.write("Cannot use Mul on diffent type than int")
-                sys.exit(53)
+                edges = [(successor, state) for successor in self.successors[block]]
+            for successor, incoming in edges:
+                merged = incoming if states[successor] == None else self.meet(states[successor], incoming)
+                if merged != states[successor]:
+                    states[successor] = merged
+                    pending.append(successor)
+        return states
+
+    def typedHandler(self, instr, state):
+        if not instr.code in self.TYPED:
+            return None
+        name, types = self.TYPED[instr.code]
+        target, op1, op2 = instr.args
+        if not self.variable(target) in state:
+            return None
+        type1 = self.operandType(op1, state)
+        if type1 in types and self.operandType(op2, state) is type1:
+            return getattr(Interpreter, name)
+        return None
+
+    def specialize(self):
+        # instructions whose operand types and target are proven get handlers
+        # without the checks, all others keep their full checks
+        states = self.inferTypes()
+        result = list(self.instructions)
+        for block, (start, end) in enumerate(self.blocks):
+            if states[block] == None:
+                continue
+            state = dict(states[block])
+            for position in range(start, end):
+                instr = self.instructions[position]
+                handler = self.typedHandler(instr, state)
+                if handler != None:
+                    result[position] = DecodedInstruction(instr.order, instr.code, handler, instr.args)
+                    self.counts["specialized"] += 1
+                state = self.transfer(instr, state)
+        return result
+
+class PythonCompiler:
+    # Translates a finished Program into Python source. Every basic block
+    # becomes a function returning the position of the next block to run.
+    # Common instructions are inlined with direct slot access behind type and
+    # frame guards; when a guard fails, and for all other instructions, the
+    # block calls the interpreter's own handler, so results, messages and
+    # exit codes are exactly those of the dispatch loop.
+    VERSION = 4
+    PLAIN = frozenset((int, bool, str, Nil))
+    ORDERED = frozenset((int, bool, str))
+    # handlers that can continue elsewhere than at the following instruction
+    CONTROL = ("instJump", "instJumpIfEq", "instJumpIfNeq", "instJumpIfEqs", "instJumpIfNeqs", "instCall",
+               "instReturn", "instExit", "instLtJump", "instGtJump", "instEqJump",
+               "instLtJumpTyped", "instGtJumpTyped", "instEqJumpTyped")
+    BINDINGS = {"GF": "it.GF", "LF": "it.LF", "stack": "it.stack", "calls": "it.calls", "write": "it.output.write"}
+    # opcode -> (guard on the operands a and b, expression of the result)
+    OPERATIONS = {
+        "ADD": ("type(a) is int and type(b) is int", "a + b"),
+        "SUB": ("type(a) is int and type(b) is int", "a - b"),
+        "MUL": ("type(a) is int and type(b) is int", "a * b"),
+        "IDIV": ("type(a) is int and type(b) is int and b != 0", "a // b"),
+        "LT": ("type(a) is type(b) and type(a) in ORDERED", "a < b"),
+        "GT": ("type(a) is type(b) and type(a) in ORDERED", "a > b"),
+        "EQ": ("type(a) is type(b) and type(a) in PLAIN", "a == b"),
+        "AND": ("type(a) is bool and type(b) is bool", "a and b"),
+        "OR": ("type(a) is bool and type(b) is bool", "a or b"),
+    }
+
+    def __init__(self, program):
+        self.instructions = program.instructions
+        self.control = {getattr(Interpreter, name) for name in self.CONTROL}
+        self.used = set()
+
+    def leaders(self):
+        starts = {0}
+        for position, instr in enumerate(self.instructions):
+            if instr.code == "LABEL" or instr.handler in self.control:
+                starts.add(position + 1)
+        return sorted(start for start in starts if start < len(self.instructions))
+
+    def source(self):
+        lines = []
+        leaders = self.leaders()
+        for i, start in enumerate(leaders):
+            end = leaders[i + 1] if i + 1 < len(leaders) else len(self.instructions)
+            lines.extend(self.block(start, end))
+        lines.append("BLOCKS = {" + ", ".join(f"{start}: b{start}" for start in leaders) + "}")
+        # sizes of the blocks and the blocks ending with CALL, for ExecutionLimits
+        ends = [leaders[i + 1] if i + 1 < len(leaders) else len(self.instructions) for i in range(len(leaders))]
+        lines.append("SIZES = {" + ", ".join(f"{start}: {end - start}" for start, end in zip(leaders, ends)) + "}")
+        calls = [start for start, end in zip(leaders, ends) if self.instructions[end - 1].code == "CALL"]
+        lines.append("CALLS = frozenset((" + "".join(f"{start}, " for start in calls) + "))")
+        lines.append("")
+        lines.append("def run(it):")
+        lines.append("    position = 0")
+        lines.append("    if it.limits is not None:")
+        lines.append("        return runLimited(it)")
+        lines.append(f"    while position < {len(self.instructions)}:")
+        lines.append("        position = BLOCKS[position](it)")
+        lines.append("")
+        lines.append("def runLimited(it):")
+        lines.append("    position = 0")
+        lines.append("    executed = 0")
+        lines.append(f"    while position < {len(self.instructions)}:")
+        lines.append("        start = position")
+        lines.append("        position = BLOCKS[start](it)")
+        lines.append("        executed += SIZES[start]")
+        lines.append("        if executed > it.budget and (position <= start or start in CALLS):")
+        lines.append("            it.executed = executed")
+        lines.append("            it.checkLimits()")
+        return "\n".join(lines) + "\n"
+
+    def block(self, start, end):
+        self.used = set()
+        body = []
+        for position in range(start, end):
+            body.extend(self.instruction(position))
+        body.append(f"return {end}")
+        head = [f"def b{start}(it):"]
+        head.extend(f"    {name} = {self.BINDINGS[name]}" for name in sorted(self.used))
+        return head + ["    " + line for line in body] + [""]
+
+    def frame(self, arg):
+        if arg.frame == "GF":
+            self.used.add("GF")
+        elif arg.frame == "LF":
+            self.used.add("LF")
+
+    def read(self, arg):
+        if not arg.isVar:
+            return "NIL" if arg.value is NIL else repr(arg.value)
+        self.frame(arg)
+        if arg.frame == "GF":
+            return f"GF[{arg.slot}]"
+        elif arg.frame == "LF":
+            return f"(LF[-1][{arg.slot}] if LF else UNDEFINED)"
+        return f"(it.TF[{arg.slot}] if it.TF is not None else UNDEFINED)"
+
+    def defined(self, arg, negate=False):
+        # guard that the variable exists (or, negated, that it can be defined)
+        self.frame(arg)
+        test = "is" if negate else "is not"
+        if arg.frame == "GF":
+            return f"GF[{arg.slot}] {test} UNDEFINED"
+        elif arg.frame == "LF":
+            return f"LF and LF[-1][{arg.slot}] {test} UNDEFINED"
+        return f"it.TF is not None and it.TF[{arg.slot}] {test} UNDEFINED"
+
+    def target(self, arg):
+        if arg.frame == "GF":
+            return f"GF[{arg.slot}]"
+        elif arg.frame == "LF":
+            return f"LF[-1][{arg.slot}]"
+        return f"it.TF[{arg.slot}]"
+
+    def instruction(self, position):
+        instr = self.instructions[position]
+        code = instr.code
+        args = instr.args
+        fallback = f"H[{position}](it, I[{position}], {position})"
+        lines = [f"# {int(instr.order)} {code}"]
+
+        if code == "LABEL":
+            return lines
+        elif code == "MOVE":
+            lines += [f"v = {self.read(args[1])}",
+                      f"if type(v) in PLAIN and {self.defined(args[0])}:",
+                      f"    {self.target(args[0])} = v"]
+        elif code in self.OPERATIONS:
+            guard, result = self.OPERATIONS[code]
+            lines += [f"a = {self.read(args[1])}",
+                      f"b = {self.read(args[2])}",
+                      f"if {guard} and {self.defined(args[0])}:",
+                      f"    {self.target(args[0])} = {result}"]
+        elif code == "NOT":
+            lines += [f"a = {self.read(args[1])}",
+                      f"if type(a) is bool and {self.defined(args[0])}:",
+                      f"    {self.target(args[0])} = not a"]
+        elif code == "DEFVAR":
+            lines += [f"if {self.defined(args[0], negate=True)}:",
+                      f"    {self.target(args[0])} = None"]
+        elif code == "WRITE":
+            self.used.add("write")
+            lines += [f"v = {self.read(args[0])}",
+                      "if type(v) in PLAIN:",
+                      "    write(fmt(v))"]
+        elif code == "PUSHS":
+            self.used.add("stack")
+            lines += [f"v = {self.read(args[0])}",
+                      "if type(v) in PLAIN:",
+                      "    stack.append(v)"]
+        elif code == "POPS":
+            self.used.add("stack")
+            lines += [f"if stack and {self.defined(args[0])}:",
+                      f"    {self.target(args[0])} = stack.pop()"]
+        elif code == "JUMP":
+            return lines + [f"return {args[0].value + 1}"]
+        elif code == "CALL":
+            self.used.add("calls")
+            return lines + [f"calls.append({position})", f"return {args[0].value + 1}"]
+        elif code == "RETURN":
+            self.used.add("calls")
+            lines += ["if calls:",
+                      "    return calls.pop() + 1",
+                      f"{fallback}"]
+            return lines
+        elif code == "JUMPIFEQ" or code == "JUMPIFNEQ":
+            test = "a == b" if code == "JUMPIFEQ" else "a != b"
+            return lines + [f"a = {self.read(args[1])}",
+                            f"b = {self.read(args[2])}",
+                            "if type(a) is type(b) and type(a) in PLAIN:",
+                            f"    if {test}:",
+                            f"        return {args[0].value + 1}",
+                            "else:",
+                            f"    n = {fallback}",
+                            f"    if n != {position}:",
+                            "        return n + 1"]
+        elif instr.handler in self.control:
+            return lines + [f"n = {fallback}",
+                            f"if n != {position}:",
+                            "    return n + 1"]
+        else:
+            return lines + [fallback]
+        return lines + ["else:", f"    {fallback}"]
+
+# load() redirects the process-wide stderr to collect error messages
+LOAD_LOCK = threading.Lock()
+
+def load(xml, optimize=False):
+    # Decodes IPPcode23 XML given as str, bytes or a binary stream into a
+    # finished Program. Invalid programs raise LoadError with the exit code
+    # and message the command line interpreter would report.
+    if isinstance(xml, str):
+        xml = xml.encode()
+    if isinstance(xml, bytes):
+        xml = io.BytesIO(xml)
+    program = Program()
+    messages = io.StringIO()
+    with LOAD_LOCK, contextlib.redirect_stderr(messages):
+        try:
+            loadProgram(xml, program)
+            program.finish(optimize)
+        except SystemExit as e:
+            raise LoadError(e.code, messages.getvalue()) from None
+    return program
 
-            result = op1 * op2
+class Interpreter:
+    # number of cleared local frames kept for reuse
+    FRAME_POOL_LIMIT = 256
+
+    # opcode -> (name of the handler method, kinds of its operands), the
+    # loader checks every instruction against it once
+    OPCODES = {
+        "CREATEFRAME": ("instCreateFrame", ()),
+        "PUSHFRAME": ("instPushFrame", ()),
+        "POPFRAME": ("instPopFrame", ()),
+        "RETURN": ("instReturn", ()),
+        "BREAK": ("instBreak", ()),
+        "CLEARS": ("instClears", ()),
+        "ADDS": ("instAdds", ()),
+        "SUBS": ("instSubs", ()),
+        "MULS": ("instMuls", ()),
+        "IDIVS": ("instIdivs", ()),
+        "LTS": ("instLts", ()),
+        "GTS": ("instGts", ()),
+        "EQS": ("instEqs", ()),
+        "ANDS": ("instAnds", ()),
+        "ORS": ("instOrs", ()),
+        "NOTS": ("instNots", ()),
+        "INT2CHARS": ("instInt2Chars", ()),
+        "STRI2INTS": ("instStri2Ints", ()),
+        "DEFVAR": ("instDefvar", ("var",)),
+        "POPS": ("instPops", ("var",)),
+        "CALL": ("instCall", ("label",)),
+        "LABEL": ("instLabel", ("label",)),
+        "JUMP": ("instJump", ("label",)),
+        "PUSHS": ("instPushs", ("symb",)),
+        "WRITE": ("instWrite", ("symb",)),
+        "EXIT": ("instExit", ("symb",)),
+        "DPRINT": ("instDprint", ("symb",)),
+        "JUMPIFEQS": ("instJumpIfEqs", ("label",)),
+        "JUMPIFNEQS": ("instJumpIfNeqs", ("label",)),
+        "MOVE": ("instMove", ("var", "symb")),
+        "INT2CHAR": ("instInt2Char", ("var", "symb")),
+        "STRLEN": ("instStrlen", ("var", "symb")),
+        "TYPE": ("instType", ("var", "symb")),
+        "READ": ("instRead", ("var", "type")),
+        "NOT": ("instNot", ("var", "symb")),
+        "ADD": ("instAdd", ("var", "symb", "symb")),
+        "SUB": ("instSub", ("var", "symb", "symb")),
+        "MUL": ("instMul", ("var", "symb", "symb")),
+        "IDIV": ("instIdiv", ("var", "symb", "symb")),
+        "LT": ("instLt", ("var", "symb", "symb")),
+        "GT": ("instGt", ("var", "symb", "symb")),
+        "EQ": ("instEq", ("var", "symb", "symb")),
+        "AND": ("instAnd", ("var", "symb", "symb")),
+        "OR": ("instOr", ("var", "symb", "symb")),
+        "STRI2INT": ("instStri2Int", ("var", "symb", "symb")),
+        "CONCAT": ("instConcat", ("var", "symb", "symb")),
+        "GETCHAR": ("instGetchar", ("var", "symb", "symb")),
+        "SETCHAR": ("instSetchar", ("var", "symb", "symb")),
+        "JUMPIFEQ": ("instJumpIfEq", ("label", "symb", "symb")),
+        "JUMPIFNEQ": ("instJumpIfNeq", ("label", "symb", "symb")),
+    }
+    # operand kind -> argument types it accepts
+    OPERANDS = {
+        "var": ("var",),
+        "symb": ("var", "int", "bool", "string", "nil"),
+        "label": ("label",),
+        "type": ("type",),
+    }
+    # types a type operand can name
+    TYPES = ("int", "string", "bool")
+
+    def __init__(self, program, input, output=None, stderr=None):
+        # self.program may be replaced for a run (see startLimits), reports
+        # read the decoded instructions
+        self.program = self.instructions = program.instructions
+        self.globalSlots = program.globalSlots
+        self.localSlots = program.localSlots
+        self.emptyFrame = program.emptyFrame
+        self.input = input
+        self.output = output if output != None else OutputBuffer(sys.stdout)
+        self.stderr = stderr if stderr != None else sys.stderr
+        self.statsFile = None
+        self.profiler = None
+        self.profileFile = None
+        self.counts = []
+        self.times = []
+        self.maxCallDepth = self.maxStackDepth = self.maxFrameDepth = 0
+        self.calls = list()
+        self.TF = None
+        self.GF = [UNDEFINED] * len(self.globalSlots)
+        self.LF = list()
+        self.stack = list()
+        self.framePool = []
+        self.framesCreated = self.framesAllocated = 0
+        self.compiledRun = program.compiledRun
+        self.limits = None
+        self.executed = self.segmentStart = 0
+        self.budget = sys.maxsize
+        self.exceeded = None
+        self.started = 0.0
+        self.watchStopped = None
+
+    def getFrame(self, variable):
+        if variable.frame == "GF":
+            return self.GF
+        elif variable.frame == "LF":
+            if len(self.LF) == 0:
+                self.stderr.write("Frame doesn't exist")
+                sys.exit(55)
+            return self.LF[-1]
+        if self.TF is None:
+            self.stderr.write("Frame doesn't exist")
+            sys.exit(55)
+        return self.TF
+
+    def setToFrame(self, variable, value):
+        frame = self.getFrame(variable)
+        if frame[variable.slot] is UNDEFINED:
+            self.stderr.write("Variable doesn't exist")
+            sys.exit(54)
+        frame[variable.slot] = value
 
-            self.setToFrame(arg1, resultval=result)
+    def getFromFrame(self, variable):
+        value = self.getFrame(variable)[variable.slot]
+        if value is UNDEFINED:
+            self.stderr.write("Variable doesn't exist")
+            sys.exit(54)
+        return value
+
+    def newFrame(self):
+        self.framesCreated += 1
+        if self.framePool:
+            return self.framePool.pop()
+        self.framesAllocated += 1
+        return self.emptyFrame.copy()
+
+    def releaseFrame(self, frame):
+        # a frame dropped from TF is referenced nowhere else, so it is cleared
+        # and handed out again by a later CREATEFRAME
+        if frame is not None and len(self.framePool) < self.FRAME_POOL_LIMIT:
+            frame[:] = self.emptyFrame
+            self.framePool.append(frame)
+
+    def frameContents(self, frame, slots):
+        if frame is None:
+            return None
+        return {name: frame[slot] for name, slot in slots.items() if frame[slot] is not UNDEFINED}
 
-            return position
-        elif instruction.code == "IDIV":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-            if arg2.checkArgType("VAR"):
-                op1 = self.intConversion(self.getFromFrame(arg2))
-            elif arg2.checkArgType("INT"):
-                op1 = self.intConversion(arg2.text)
-            else:
-                sys.stderr.write("Cannot use Mul on diffent type than int")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.intConversion(self.getFromFrame(arg3))
-            elif arg3.checkArgType("INT"):
-                op2 = self.intConversion(arg3.text)
+    def interpretInst(self):
+        if self.limits:
+            self.startLimits()
+        if self.profiler:
+            self.profiler.start(self)
+        try:
+            if self.statsFile:
+                self.executeWithStats()
+            elif self.compiledRun:
+                self.compiledRun(self)
             else:
-                sys.stderr.write("Cannot use Mul on diffent type than int")
-                sys.exit(53)
+                self.execute()
+        finally:
+            # also runs for EXIT and runtime errors, which leave through sys.exit
+            if self.watchStopped:
+                self.watchStopped.set()
+            self.output.flush()
+            if self.profiler:
+                self.profiler.stop()
+                self.profiler.write(self.profileFile)
+            if self.statsFile:
+                self.writeStats(self.statsFile)
+
+    def startLimits(self):
+        # control instructions of this run are wrapped by instCheckpoint, the
+        # shared program keeps its own handlers
+        control = {getattr(Interpreter, name) for name in PythonCompiler.CONTROL}
+        self.program = tuple(DecodedInstruction(instr.order, instr.code, Interpreter.instCheckpoint, (instr,))
+                             if instr.handler in control else instr for instr in self.program)
+        if self.limits.instructions != None:
+            self.budget = self.limits.instructions
+        self.started = time.perf_counter()
+        if self.limits.seconds != None or self.limits.megabytes != None:
+            self.watchStopped = threading.Event()
+            threading.Thread(target=self.limits.watch, args=(self, self.watchStopped), daemon=True).start()
+
+    def checkLimits(self):
+        # called at a checkpoint past the budget
+        limit = self.exceeded or "instructions"
+        elapsed = time.perf_counter() - self.started
+        self.stderr.write(f"Execution limit of {self.limits.describe(limit)} exceeded: executed {self.executed} "
+                          f"instructions in {elapsed:.3f} s, {ExecutionLimits.residentMemory() // 1024} KB resident\n")
+        sys.exit(ExecutionLimits.EXIT_CODE)
+
+    def execute(self):
+        program = self.program
+        end = len(program)
+        position = 0
+        while position < end:
+            instr = program[position]
+            position = instr.handler(self, instr, position) + 1
+
+    def executeWithStats(self):
+        # same loop as execute() with per-position counters and timers, used
+        # only for --stats so the ordinary loop stays free of bookkeeping
+        program = self.program
+        end = len(program)
+        self.counts = counts = [0] * end
+        self.times = times = [0.0] * end
+        self.maxCallDepth = self.maxStackDepth = self.maxFrameDepth = 0
+        clock = time.perf_counter
+        position = 0
+        while position < end:
+            instr = program[position]
+            counts[position] += 1
+            start = clock()
+            following = instr.handler(self, instr, position) + 1
+            times[position] += clock() - start
+            if len(self.calls) > self.maxCallDepth:
+                self.maxCallDepth = len(self.calls)
+            if len(self.stack) > self.maxStackDepth:
+                self.maxStackDepth = len(self.stack)
+            if len(self.LF) > self.maxFrameDepth:
+                self.maxFrameDepth = len(self.LF)
+            position = following
+
+    def writeStats(self, path, hottest=20):
+        opcodes = {}
+        for instr, count, spent in zip(self.instructions, self.counts, self.times):
+            if count:
+                entry = opcodes.setdefault(instr.code, {"count": 0, "time": 0.0})
+                entry["count"] += count
+                entry["time"] += spent
+        ranked = sorted(range(len(self.instructions)), key=lambda i: self.counts[i], reverse=True)[:hottest]
+        stats = {
+            "instructions": sum(self.counts),
+            "opcodes": dict(sorted(opcodes.items(), key=lambda item: item[1]["time"], reverse=True)),
+            "hottest": [{"order": self.instructions[i].order, "opcode": self.instructions[i].code,
+                         "count": self.counts[i], "time": self.times[i]}
+                        for i in ranked if self.counts[i]],
+            "max_call_depth": self.maxCallDepth,
+            "max_stack_depth": self.maxStackDepth,
+            "max_frame_depth": self.maxFrameDepth,
+            "frames": {
+                "created": self.framesCreated,
+                "allocated": self.framesAllocated,
+                "reused": self.framesCreated - self.framesAllocated,
+                "pooled": len(self.framePool),
+            },
+        }
+        try:
+            with open(path, "w") as f:
+                json.dump(stats, f, indent=2)
+        except OSError as e:
+            self.stderr.write(f"Cannot write statistics: {e}")
+            sys.exit(12)
+
+    def getSymb(self, arg):
+        if arg.isVar:
+            value = self.getFromFrame(arg)
+            if value is None:
+                self.stderr.write("Missing value")
+                sys.exit(56)
+            if type(value) is StringBuffer:
+                return value.value()
+            return value
+        return arg.value
+
+    def getString(self, arg):
+        # like getSymb, but a StringBuffer is returned as it is
+        if arg.isVar:
+            value = self.getFromFrame(arg)
+            if value is None:
+                self.stderr.write("Missing value")
+                sys.exit(56)
+            return value
+        return arg.value
+
+    def indexOperands(self, instruction):
+        arg1, arg2, arg3 = instruction.args
+        op1 = self.getString(arg2)
+        op2 = self.getSymb(arg3)
+        if (type(op1) is not str and type(op1) is not StringBuffer) or type(op2) is not int:
+            self.stderr.write(f"Instruction {instruction.code} requires operands of type string and int")
+            sys.exit(53)
+        return arg1, op1, op2
 
-            try:
-                result = op1 // op2
-            except ZeroDivisionError as e:
-                sys.stderr.write(f"ZeroDivisionError {e}")
-                sys.exit(57)
-            self.setToFrame(arg1, resultval=result)
-            return position
-        elif instruction.code == "LT":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-            
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if( op1 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op1 == "nil":
-                    type1 = "nil"
-                else:
-                    try:
-                        int(op1)
-                        type1 = "int"
-                    except ValueError:
-                        type1 = 'string'
-                        try:
-                            if op1.upper() == "TRUE" or op1.upper() == "FALSE":
-                                type1 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op1 = arg2.text
-                type1 = arg2.type
-            
-   
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if( op2 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op2 == "nil":
-                    type2 = 'nil'
-                else:
-                    try:
-                        int(op2)
-                        type2 = "int"
-                    except ValueError:
-                        type2 = 'string'
-                        try:
-                            if op2.upper() == "TRUE" or op2.upper() == "FALSE":
-                                type2 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op2 = arg3.text
-                type2 = arg3.type
+    def operands(self, instruction):
+        arg1, arg2, arg3 = instruction.args
+        return arg1, self.getSymb(arg2), self.getSymb(arg3)
 
-            if type1 == "nil" or type2 == "nil":
-                sys.stderr.write("Cannot use GT with nil")
-                sys.exit(53)
-            
-            if type1 == 'bool' and type2 == 'bool':
-                if op1 == "true" and op2 == "false":
-                    result = 'false'
-                elif op1 == "false" and op2 == "true":
-                    result = 'true'
-                else:
-                    result = 'false'
-            elif type1 == 'int' and type2 == 'int':
-                    result = str(op1 < op2).lower()
-            elif type1 == 'string' and type2 == 'string':
-                if op1 == None and op2 != None:
-                    result = 'false'
-                elif op2 == None and op1 != None:
-                    result = 'true'
-                else:
-                    result = str(op1 < op2).lower()
-            else:
-                sys.stderr.write("Cannot use Getchar with different types")
-                sys.exit(53)
-            self.setToFrame(arg1, resultval=result)
+    def typedOperands(self, instruction, type1, type2):
+        arg1, op1, op2 = self.operands(instruction)
+        if type(op1) is not type1 or type(op2) is not type2:
+            self.stderr.write(f"Instruction {instruction.code} requires operands of type {TYPE_NAMES[type1]} and {TYPE_NAMES[type2]}")
+            sys.exit(53)
+        return arg1, op1, op2
 
-            return position
-        elif instruction.code == "GT":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-            
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if( op1 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op1 == "nil":
-                    type1 = "nil"
-                else:
-                    try:
-                        int(op1)
-                        type1 = "int"
-                    except ValueError:
-                        type1 = 'string'
-                        try:
-                            if op1.upper() == "TRUE" or op1.upper() == "FALSE":
-                                type1 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op1 = arg2.text
-                type1 = arg2.type
-            
-   
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if( op2 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op2 == "nil":
-                    type2 = 'nil'
-                else:
-                    try:
-                        int(op2)
-                        type2 = "int"
-                    except ValueError:
-                        type2 = 'string'
-                        try:
-                            if op2.upper() == "TRUE" or op2.upper() == "FALSE":
-                                type2 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op2 = arg3.text
-                type2 = arg3.type
+    def relationalOperands(self, instruction):
+        arg1, op1, op2 = self.operands(instruction)
+        if type(op1) is not type(op2) or type(op1) is Nil:
+            self.stderr.write(f"Instruction {instruction.code} requires operands of the same type other than nil")
+            sys.exit(53)
+        return arg1, op1, op2
 
-            if type1 == "nil" or type2 == "nil":
-                sys.stderr.write("Cannot use GT with nil")
+    def equals(self, instruction, op1, op2):
+        if type(op1) is not type(op2):
+            if type(op1) is not Nil and type(op2) is not Nil:
+                self.stderr.write(f"Cannot use {instruction.code} with different types")
                 sys.exit(53)
-            
-            if type1 == 'bool' and type2 == 'bool':
-                if op1 == "true" and op2 == "false":
-                    result = 'true'
-                elif op1 == "false" and op2 == "true":
-                    result = 'false'
-                else:
-                    result = 'false'
-            elif type1 == 'int' and type2 == 'int':
-                    result = str(op1 > op2).lower()
-            elif type1 == 'string' and type2 == 'string':
-                if op1 == None and op2 != None:
-                    result = 'false'
-                elif op2 == None and op1 != None:
-                    result = 'true'
-                else:
-                    result = str(op1 > op2).lower()
-            else:
-                sys.stderr.write("Cannot use Getchar with different types")
-                sys.exit(53)
-            self.setToFrame(arg1, resultval=result)
+            return False
+        return op1 == op2
 
-            return position
-        elif instruction.code == "EQ":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
+    def conditionalJump(self, instruction, position, jumpIfEqual):
+        arg1, arg2, arg3 = instruction.args
+        if self.equals(instruction, self.getSymb(arg2), self.getSymb(arg3)) == jumpIfEqual:
+            return arg1.value
+        return position
 
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if( op1 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op1 == "nil":
-                    type1 = "nil"
-                else:
-                    try:
-                        int(op1)
-                        type1 = "int"
-                    except ValueError:
-                        type1 = 'string'
-                        try:
-                            if op1.upper() == "TRUE" or op1.upper() == "FALSE":
-                                type1 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op1 = arg2.text
-                type1 = arg2.type
-            
-   
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if( op2 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op2 == "nil":
-                    type2 = 'nil'
-                else:
-                    try:
-                        int(op2)
-                        type2 = "int"
-                    except ValueError:
-                        type2 = 'string'
-                        try:
-                            if op2.upper() == "TRUE" or op2.upper() == "FALSE":
-                                type2 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op2 = arg3.text
-                type2 = arg3.type
+    def popOperand(self, instruction):
+        if len(self.stack) == 0:
+            self.stderr.write(f"Instruction {instruction.code} has no value to pop")
+            sys.exit(56)
+        return self.stack.pop()
 
-            if type1 == type2 or type1 == "nil" or type2 == "nil":
-                pass
-            else:
-                sys.stderr.write("Cannot use EQ with different types")
-                sys.exit(53)
-            
-            if op1 == op2:
-                self.setToFrame(arg1, resultval="true")
-            else:
-                self.setToFrame(arg1, resultval="false")
+    def popOperands(self, instruction):
+        stack = self.stack
+        if len(stack) < 2:
+            self.stderr.write(f"Instruction {instruction.code} needs two values on the stack")
+            sys.exit(56)
+        op2 = stack.pop()
+        return stack.pop(), op2
 
+    def stackTypedOperands(self, instruction, type1, type2):
+        op1, op2 = self.popOperands(instruction)
+        if type(op1) is not type1 or type(op2) is not type2:
+            self.stderr.write(f"Instruction {instruction.code} requires operands of type {TYPE_NAMES[type1]} and {TYPE_NAMES[type2]}")
+            sys.exit(53)
+        return op1, op2
 
-            return position
-        elif instruction.code == "AND":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
+    def stackRelationalOperands(self, instruction):
+        op1, op2 = self.popOperands(instruction)
+        if type(op1) is not type(op2) or type(op1) is Nil:
+            self.stderr.write(f"Instruction {instruction.code} requires operands of the same type other than nil")
+            sys.exit(53)
+        return op1, op2
+
+    def stackConditionalJump(self, instruction, position, jumpIfEqual):
+        arg1, = instruction.args
+        op1, op2 = self.popOperands(instruction)
+        if self.equals(instruction, op1, op2) == jumpIfEqual:
+            return arg1.value
+        return position
+
+    @staticmethod
+    def formatValue(value):
+        if value is True:
+            return "true"
+        elif value is False:
+            return "false"
+        elif value is NIL:
+            return ""
+        return str(value)
+
+    def instReturn(self, instruction, position):
+        if len(self.calls) == 0:
+            self.stderr.write("Call for this return doesn't exist")
+            sys.exit(56)
 
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if( op1 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg2.checkArgType("BOOL"):
-                op1 = arg2.text
-            else:
-                sys.stderr.write("Cannot use And on different type than bool")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if( op2 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg3.checkArgType("BOOL"):
-                op2 = arg3.text
-            else:
-                sys.stderr.write("Cannot use And on different type than bool")
-                sys.exit(53)
+        return self.calls.pop()
+    def instCreateFrame(self, instruction, position):
+        self.releaseFrame(self.TF)
+        self.TF = self.newFrame()
+        return position
+    def instPushFrame(self, instruction, position):
+        if self.TF == None:
+            self.stderr.write("Frame doesn't exist")
+            sys.exit(55)
+        else:
+            newFrame = self.TF
+            self.LF.append(newFrame)
+            self.TF = None
+        return position
+    def instPopFrame(self, instruction, position):
+        if len(self.LF) == 0:
+            self.stderr.write("Frame for pop doesn't exist")
+            sys.exit(55)
+        else:
+            self.releaseFrame(self.TF)
+            self.TF = self.LF.pop()
+        return position
+    def instBreak(self, instruction, position):
+        GF = self.frameContents(self.GF, self.globalSlots)
+        TF = self.frameContents(self.TF, self.localSlots)
+        LF = [self.frameContents(frame, self.localSlots) for frame in self.LF]
+        self.output.flush()
+        self.stderr.write(f"Instruction order: {instruction.order}, actual position: {position}\nFrames - GF: {GF}\nTF: {TF}\nLF: {LF}")
+        return position
+    def instDefvar(self, instruction, position):
+        arg1, = instruction.args
+        frame = self.getFrame(arg1)
+        if frame[arg1.slot] is not UNDEFINED:
+            self.stderr.write("Cannot redefine a variable")
+            sys.exit(52)
+        frame[arg1.slot] = None
+
+        return position
+
+    def instLabel(self, instruction, position):
+        return position
+
+    def instPushs(self, instruction, position):
+        arg1, = instruction.args
+        self.stack.append(self.getSymb(arg1))
+        return position
+    def instPops(self, instruction, position):
+        arg1, = instruction.args
+        if len(self.stack) == 0:
+            self.stderr.write("There's no value to be popped")
+            sys.exit(56)
 
-            if op1 == "true" and op2 == "true":
-                self.setToFrame(arg1, resultval="true")
+        self.setToFrame(arg1, self.stack.pop())
+        return position
+    def instCall(self, instruction, position):
+        arg1, = instruction.args
+        self.calls.append(position)
+        return arg1.value
+
+    def instWrite(self, instruction, position):
+        arg1, = instruction.args
+        self.output.write(self.formatValue(self.getSymb(arg1)))
+        return position
+
+    def instJump(self, instruction, position):
+        arg1, = instruction.args
+        return arg1.value
+    def instExit(self, instruction, position):
+        arg1, = instruction.args
+        code = self.getSymb(arg1)
+        if type(code) is not int:
+            self.stderr.write("Cannot exit with this type")
+            sys.exit(53)
+        if code <= 49 and code >= 0:
+            sys.exit(code)
+        else:
+            self.stderr.write("Cannot exit with this exit code")
+            sys.exit(57)
+
+    def instDprint(self, instruction, position):
+        arg1, = instruction.args
+        value = self.formatValue(self.getSymb(arg1))
+        self.output.flush()
+        self.stderr.write(value)
+        return position
+    def instRead(self, instruction, position):
+        arg1, arg2 = instruction.args
+        item = self.input.readLine()
+        # the end of input reads as nil, surrounding whitespace is ignored
+        if item is None:
+            value = NIL
+        else:
+            item = item.strip()
+            if arg2.text == "bool":
+                value = item.upper() == "TRUE"
+            elif arg2.text == "int":
+                try:
+                    value = int(item)
+                except ValueError:
+                    value = NIL
             else:
-                self.setToFrame(arg1, resultval="false")
+                value = item
 
-            return position
-        elif instruction.code == "OR":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-            
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if( op1 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg2.checkArgType("BOOL"):
-                op1 = arg2.text
-            else:
-                sys.stderr.write("Cannot use And on different type than bool")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if( op2 == None):
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg3.checkArgType("BOOL"):
-                op2 = arg3.text
-            else:
-                sys.stderr.write("Cannot use And on different type than bool")
-                sys.exit(53)
+        self.setToFrame(arg1, value)
 
-            if op1 == "true" or op2 == "true":
-                self.setToFrame(arg1, resultval="true")
-            else:
-                self.setToFrame(arg1, resultval="false")
-            
-            return position
-        elif instruction.code == "STRI2INT":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-            
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg2.checkArgType("STRING"):
-                op1 = arg2.text
-            else:
-                sys.stderr.write("Cannot use Stri2int with different type than int and string")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if op2 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg3.checkArgType("INT"):
-                op2 = arg3.text
-            else:
-                sys.stderr.write("Cannot use Stri2int with different type than int and string")
-                sys.exit(53)
+        return position
+    def instInt2Char(self, instruction, position):
+        arg1, arg2 = instruction.args
+        op1 = self.getSymb(arg2)
+        if type(op1) is not int:
+            self.stderr.write("Cannot use Int2char on different type than int")
+            sys.exit(53)
 
-            if self.intConversion(op2) < 0 or self.intConversion(op2) > len(op1)-1:
-                sys.stderr.write("Index out of range")
-                sys.exit(58)
-            
-            result = ord(op1[self.intConversion(op2)])
-            self.setToFrame(arg1, resultval=result)
-
-            return position
-        elif instruction.code == "CONCAT":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
+        try:
+            op1 = chr(op1)
+        except (ValueError, OverflowError) as e:
+            self.stderr.write("Value cannot be converted to char")
+            sys.exit(58)
 
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg2.checkArgType("STRING"):
-                op1 = arg2.text
-            else:
-                sys.stderr.write("Cannot use Concat on different type than string")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if op2 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg3.checkArgType("STRING"):
-                op2 = arg3.text
-            else:
-                sys.stderr.write("Cannot use Concat on different type than string")
-                sys.exit(53)
+        self.setToFrame(arg1, op1)
 
-            if op1 == None:
-                result = op2
-            elif op2 == None:
-                result = op1
-            else:
-                result = op1 + op2
-            if( result == None ):
-                result = ""
+        return position
+    def instStrlen(self, instruction, position):
+        arg1, arg2 = instruction.args
+        op1 = self.getString(arg2)
+        if type(op1) is not str and type(op1) is not StringBuffer:
+            self.stderr.write("Cannot use Strlen on different type than string")
+            sys.exit(53)
 
-            self.setToFrame(arg1, resultval=result)
+        self.setToFrame(arg1, len(op1))
+        return position
 
-            return position
+    def instType(self, instruction, position):
+        arg1, arg2 = instruction.args
+        if arg2.isVar:
+            op1 = self.getFromFrame(arg2)
+        else:
+            op1 = arg2.value
 
-        elif instruction.code == "GETCHAR":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-            
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg2.checkArgType("STRING"):
-                op1 = arg2.text
-            else:
-                sys.stderr.write("Cannot use Getchar on different type than string")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if op2 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg3.checkArgType("INT"):
-                op2 = arg3.text
-            else:
-                sys.stderr.write("Cannot use Getchar with different type than int")
-                sys.exit(53)
+        self.setToFrame(arg1, "" if op1 is None else TYPE_NAMES[type(op1)])
 
-            try:
-                if self.intConversion(op2) < 0:
-                    sys.stderr.write("String index out of range")
-                    sys.exit(58)
-                    
-                result = op1[self.intConversion(op2)]
-            except IndexError as e:
-                sys.stderr.write("String index out of range")
-                sys.exit(58)
-                
-            self.setToFrame(arg1, resultval=result)
-            
-            return position
-        elif instruction.code == "SETCHAR":
-            if not arg1.checkArgType("VAR") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-                
-            op1 = self.getFromFrame(arg1)
-            if op1 == None:
-                sys.stderr.write("Missing value")
-                sys.exit(56)
-            if op1 == "nil":
-                sys.stderr.write("Variable cannot be nil")
-                sys.exit(53)
-            if op1.upper() == "TRUE" or op1.upper() == "FALSE":
-                sys.stderr.write("Variable cannot be bool")
-                sys.exit(53)
+        return position
 
-            if arg2.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg2)
-                if op2 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg2.checkArgType("INT"):
-                op2 = arg2.text
-            else:
-                sys.stderr.write("Cannot use Setchar with different type than int and string")
-                sys.exit(53)
-            if arg3.checkArgType("VAR"):
-                op3 = self.getFromFrame(arg3)
-                if op3 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-            elif arg3.checkArgType("STRING"):
-                op3 = arg3.text
-                if op3 == None:
-                    sys.stderr.write("Modifier for Setchar cannot be empty")
-                    sys.exit(58)
-            else:
-                sys.stderr.write("Cannot use Setchar with different type than int and string")
-                sys.exit(53)
-            
-            for i in range(len(op1)):
-                if i == int(op2):
-                    try:
-                        result = op1[:i] + op3 + op1[i+1:]
-                        self.setToFrame(arg1, resultval=result)
-                        return position
-                    except IndexError as e:
-                        sys.stderr.write("Index is out of range")
-                        sys.exit(58)
-            sys.stderr.write("Index is out of range")
-            sys.exit(58)
-        elif instruction.code == "JUMPIFEQ":
-            if not arg1.checkArgType("LABEL") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
-                
-            
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op1 == "nil":
-                    type1 = 'nil'
-                else:
-                    try:
-                        op1 = int(op1)
-                        type1 = "int"
-                    except ValueError:
-                        type1 = 'string'
-                        try:
-                            if op1.upper() == "TRUE" or op1.upper() == "FALSE":
-                                type1 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op1 = arg2.text
-                type1 = arg2.type
-                if type1 == "int":
-                    op1 = int(op1)
-
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if op2 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op2 == "nil":
-                    type2 = 'nil'
-                else:
-                    try:
-                        op2 = int(op2)
-                        type2 = "int"
-                    except ValueError:
-                        type2 = 'string'
-                        try:
-                            if op2.upper() == "TRUE" or op2.upper() == "FALSE":
-                                type2 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op2 = arg3.text
-                type2 = arg3.type
-                if type2 == "int":
-                    op2 = int(op2)
-
-            if type1 != type2 and type1 != "nil" and type2 != "nil":
-                sys.stderr.write("Cannot use Jumpifeq with different types")
-                sys.exit(53)
+    def instMove(self, instruction, position):
+        arg1, arg2 = instruction.args
+        self.setToFrame(arg1, self.getSymb(arg2))
 
-            if op1 == op2:
-                if arg1.text in self.labels.keys():
-                    return self.labels[arg1.text]
-                else:
-                    sys.stderr.write("Label doesn't exist")
-                    sys.exit(52)
-                    
-            return position
-        elif instruction.code == "JUMPIFNEQ":
-            if not arg1.checkArgType("LABEL") or not arg2.checkSymb() or not arg3.checkSymb():
-                sys.stderr.write(f"Instruction {instruction.code} has bad arguments")
-                sys.exit(32)
+        return position
+    def instNot(self, instruction, position):
+        arg1, arg2 = instruction.args
+        op1 = self.getSymb(arg2)
+        if type(op1) is not bool:
+            self.stderr.write("Cannot use Not on different type than bool")
+            sys.exit(53)
 
-            if arg2.checkArgType("VAR"):
-                op1 = self.getFromFrame(arg2)
-                if op1 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op1 == "nil":
-                    type1 = 'nil'
-                else:
-                    try:
-                        op1 = int(op1)
-                        type1 = "int"
-                    except ValueError:
-                        type1 = 'string'
-                        try:
-                            if op1.upper() == "TRUE" or op1.upper() == "FALSE":
-                                type1 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op1 = arg2.text
-                type1 = arg2.type
-                if type1 == "int":
-                    op1 = int(op1)
-
-            if arg3.checkArgType("VAR"):
-                op2 = self.getFromFrame(arg3)
-                if op2 == None:
-                    sys.stderr.write("Missing value")
-                    sys.exit(56)
-                if op2 == "nil":
-                    type2 = 'nil'
-                else:
-                    try:
-                        op2 = int(op2)
-                        type2 = "int"
-                    except ValueError:
-                        type2 = 'string'
-                        try:
-                            if op2.upper() == "TRUE" or op2.upper() == "FALSE":
-                                type2 = 'bool'
-                        except ValueError:
-                            pass
-            else:
-                op2 = arg3.text
-                type2 = arg3.type
-                if type2 == "int":
-                    op2 = int(op2)
+        self.setToFrame(arg1, not op1)
+
+        return position
+
+    def instAdd(self, instruction, position):
+        arg1, op1, op2 = self.typedOperands(instruction, int, int)
+        self.setToFrame(arg1, op1 + op2)
+        return position
+    def instSub(self, instruction, position):
+        arg1, op1, op2 = self.typedOperands(instruction, int, int)
+        self.setToFrame(arg1, op1 - op2)
+        return position
+    def instMul(self, instruction, position):
+        arg1, op1, op2 = self.typedOperands(instruction, int, int)
+        self.setToFrame(arg1, op1 * op2)
+        return position
+    def instIdiv(self, instruction, position):
+        arg1, op1, op2 = self.typedOperands(instruction, int, int)
+        if op2 == 0:
+            self.stderr.write("Division by zero")
+            sys.exit(57)
+        self.setToFrame(arg1, op1 // op2)
+        return position
+    def instLt(self, instruction, position):
+        arg1, op1, op2 = self.relationalOperands(instruction)
+        self.setToFrame(arg1, op1 < op2)
+        return position
+    def instGt(self, instruction, position):
+        arg1, op1, op2 = self.relationalOperands(instruction)
+        self.setToFrame(arg1, op1 > op2)
+        return position
+    def instEq(self, instruction, position):
+        arg1, op1, op2 = self.operands(instruction)
+        self.setToFrame(arg1, self.equals(instruction, op1, op2))
+        return position
+    def instAnd(self, instruction, position):
+        arg1, op1, op2 = self.typedOperands(instruction, bool, bool)
+        self.setToFrame(arg1, op1 and op2)
+        return position
+    def instOr(self, instruction, position):
+        arg1, op1, op2 = self.typedOperands(instruction, bool, bool)
+        self.setToFrame(arg1, op1 or op2)
+        return position
+    def instStri2Int(self, instruction, position):
+        arg1, op1, op2 = self.indexOperands(instruction)
+        if op2 < 0 or op2 >= len(op1):
+            self.stderr.write("Index out of range")
+            sys.exit(58)
+        self.setToFrame(arg1, ord(op1[op2]))
+        return position
+    def instConcat(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        appending = arg2.isVar and arg1.slot == arg2.slot and arg1.frame == arg2.frame
+        if appending:
+            current = self.getFromFrame(arg2)
+            if type(current) is StringBuffer:
+                op2 = self.getSymb(arg3)
+                if type(op2) is not str:
+                    self.stderr.write(f"Instruction {instruction.code} requires operands of type string and string")
+                    sys.exit(53)
+                current.append(op2)
+                return position
 
-            if type1 != type2 and type1 != "nil" and type2 != "nil":
-                sys.stderr.write("Cannot use Jumpifneq with different types")
-                sys.exit(53)
-                
-            if op1 != op2 or op1 == 'nil' or op2 == 'nil':
-                if arg1.text in self.labels.keys():
-                    return self.labels[arg1.text]
-                else:
-                    sys.stderr.write("Label doesn't exist")
-                    sys.exit(52)
-            
-            return position
+        arg1, op1, op2 = self.typedOperands(instruction, str, str)
+        if appending:
+            # the variable keeps growing, later appends go to the buffer
+            buffer = StringBuffer(op1)
+            buffer.append(op2)
+            self.setToFrame(arg1, buffer)
         else:
-            sys.stderr.write("Wrong number of arguments")
-            sys.exit(32)
-
-    def sortlist(self):
-        def convertInstOrder( op ):
-            try:
-                op = int(op.lstrip('0'))
-            except ValueError:
-                raise ValueError("Order has to be number")
-
-            if op <= 0:
-                raise ValueError("Order has to be bigger than zero")
-            return op
-
+            self.setToFrame(arg1, op1 + op2)
+        return position
+    def instGetchar(self, instruction, position):
+        arg1, op1, op2 = self.indexOperands(instruction)
+        if op2 < 0 or op2 >= len(op1):
+            self.stderr.write("String index out of range")
+            sys.exit(58)
+        self.setToFrame(arg1, op1[op2])
+        return position
+    def instSetchar(self, instruction, position):
+        arg1, op2, op3 = self.typedOperands(instruction, int, str)
+        op1 = self.getString(arg1)
+        if type(op1) is not str and type(op1) is not StringBuffer:
+            self.stderr.write("Cannot use Setchar on different type than string")
+            sys.exit(53)
+        if op2 < 0 or op2 >= len(op1) or op3 == "":
+            self.stderr.write("Index is out of range")
+            sys.exit(58)
+        if type(op1) is str:
+            op1 = StringBuffer(op1)
+            self.setToFrame(arg1, op1)
+        op1.setChar(op2, op3[0])
+        return position
+    def instJumpIfEq(self, instruction, position):
+        return self.conditionalJump(instruction, position, True)
+    def instJumpIfNeq(self, instruction, position):
+        return self.conditionalJump(instruction, position, False)
+
+    def instClears(self, instruction, position):
+        self.stack.clear()
+        return position
+    def instAdds(self, instruction, position):
+        op1, op2 = self.stackTypedOperands(instruction, int, int)
+        self.stack.append(op1 + op2)
+        return position
+    def instSubs(self, instruction, position):
+        op1, op2 = self.stackTypedOperands(instruction, int, int)
+        self.stack.append(op1 - op2)
+        return position
+    def instMuls(self, instruction, position):
+        op1, op2 = self.stackTypedOperands(instruction, int, int)
+        self.stack.append(op1 * op2)
+        return position
+    def instIdivs(self, instruction, position):
+        op1, op2 = self.stackTypedOperands(instruction, int, int)
+        if op2 == 0:
+            self.stderr.write("Division by zero")
+            sys.exit(57)
+        self.stack.append(op1 // op2)
+        return position
+    def instLts(self, instruction, position):
+        op1, op2 = self.stackRelationalOperands(instruction)
+        self.stack.append(op1 < op2)
+        return position
+    def instGts(self, instruction, position):
+        op1, op2 = self.stackRelationalOperands(instruction)
+        self.stack.append(op1 > op2)
+        return position
+    def instEqs(self, instruction, position):
+        op1, op2 = self.popOperands(instruction)
+        self.stack.append(self.equals(instruction, op1, op2))
+        return position
+    def instAnds(self, instruction, position):
+        op1, op2 = self.stackTypedOperands(instruction, bool, bool)
+        self.stack.append(op1 and op2)
+        return position
+    def instOrs(self, instruction, position):
+        op1, op2 = self.stackTypedOperands(instruction, bool, bool)
+        self.stack.append(op1 or op2)
+        return position
+    def instNots(self, instruction, position):
+        op1 = self.popOperand(instruction)
+        if type(op1) is not bool:
+            self.stderr.write("Cannot use Nots on different type than bool")
+            sys.exit(53)
+        self.stack.append(not op1)
+        return position
+    def instInt2Chars(self, instruction, position):
+        op1 = self.popOperand(instruction)
+        if type(op1) is not int:
+            self.stderr.write("Cannot use Int2chars on different type than int")
+            sys.exit(53)
         try:
-            self.instList.sort(key=lambda instr: convertInstOrder(instr.order))
-        except ValueError as e:
-            sys.stderr.write(str(e))
-            sys.exit(32)
-
-    def printList(self):
-        for item in self.instList:
-            print(item.order + " " + item.code + "")
-            for arg, argitem in item.argdict.items():
-                print(arg + " " + argitem.text)
-        exit(0)
+            self.stack.append(chr(op1))
+        except (ValueError, OverflowError) as e:
+            self.stderr.write("Value cannot be converted to char")
+            sys.exit(58)
+        return position
+    def instStri2Ints(self, instruction, position):
+        op1, op2 = self.stackTypedOperands(instruction, str, int)
+        if op2 < 0 or op2 >= len(op1):
+            self.stderr.write("Index out of range")
+            sys.exit(58)
+        self.stack.append(ord(op1[op2]))
+        return position
+    def instJumpIfEqs(self, instruction, position):
+        return self.stackConditionalJump(instruction, position, True)
+    def instJumpIfNeqs(self, instruction, position):
+        return self.stackConditionalJump(instruction, position, False)
+
+    def instCheckpoint(self, instruction, position):
+        # Wraps a control instruction while limits are set. The instructions
+        # since the previous control instruction ran one after another, so
+        # they are counted here at once.
+        original, = instruction.args
+        following = original.handler(self, original, position)
+        self.executed += position - self.segmentStart + 1
+        self.segmentStart = following + 1
+        if self.executed > self.budget and (following < position or original.code == "CALL"):
+            self.checkLimits()
+        return following
+
+    def instCreatePushFrame(self, instruction, position):
+        self.releaseFrame(self.TF)
+        self.LF.append(self.newFrame())
+        self.TF = None
+        return position
+    def instDefvarMove(self, instruction, position):
+        arg1, arg2 = instruction.args
+        frame = self.getFrame(arg1)
+        if frame[arg1.slot] is not UNDEFINED:
+            self.stderr.write("Cannot redefine a variable")
+            sys.exit(52)
+        frame[arg1.slot] = None
+        frame[arg1.slot] = self.getSymb(arg2)
+        return position
+    def instLtJump(self, instruction, position):
+        compare, label, jumpWhen = instruction.args
+        arg1, op1, op2 = self.relationalOperands(compare)
+        result = op1 < op2
+        self.setToFrame(arg1, result)
+        return label.value if result == jumpWhen else position
+    def instGtJump(self, instruction, position):
+        compare, label, jumpWhen = instruction.args
+        arg1, op1, op2 = self.relationalOperands(compare)
+        result = op1 > op2
+        self.setToFrame(arg1, result)
+        return label.value if result == jumpWhen else position
+    def instEqJump(self, instruction, position):
+        compare, label, jumpWhen = instruction.args
+        arg1, op1, op2 = self.operands(compare)
+        result = self.equals(compare, op1, op2)
+        self.setToFrame(arg1, result)
+        return label.value if result == jumpWhen else position
+
+    # Handlers picked by ControlFlowGraph.specialize when type inference proved
+    # the operand types and that the target variable exists.
+    def provenFrame(self, arg):
+        if arg.frame == "GF":
+            return self.GF
+        elif arg.frame == "LF":
+            return self.LF[-1]
+        return self.TF
+
+    def provenValue(self, arg):
+        if arg.isVar:
+            return self.provenFrame(arg)[arg.slot]
+        return arg.value
+
+    def provenString(self, arg):
+        value = self.provenValue(arg)
+        return value.value() if type(value) is StringBuffer else value
+
+    def instAddTyped(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        self.provenFrame(arg1)[arg1.slot] = self.provenValue(arg2) + self.provenValue(arg3)
+        return position
+    def instSubTyped(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        self.provenFrame(arg1)[arg1.slot] = self.provenValue(arg2) - self.provenValue(arg3)
+        return position
+    def instMulTyped(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        self.provenFrame(arg1)[arg1.slot] = self.provenValue(arg2) * self.provenValue(arg3)
+        return position
+    def instIdivTyped(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        op2 = self.provenValue(arg3)
+        if op2 == 0:
+            self.stderr.write("Division by zero")
+            sys.exit(57)
+        self.provenFrame(arg1)[arg1.slot] = self.provenValue(arg2) // op2
+        return position
+    def instLtTyped(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        self.provenFrame(arg1)[arg1.slot] = self.provenValue(arg2) < self.provenValue(arg3)
+        return position
+    def instGtTyped(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        self.provenFrame(arg1)[arg1.slot] = self.provenValue(arg2) > self.provenValue(arg3)
+        return position
+    def instEqTyped(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        self.provenFrame(arg1)[arg1.slot] = self.provenValue(arg2) == self.provenValue(arg3)
+        return position
+    def instConcatTyped(self, instruction, position):
+        arg1, arg2, arg3 = instruction.args
+        frame = self.provenFrame(arg1)
+        op2 = self.provenString(arg3)
+        if arg2.isVar and arg1.slot == arg2.slot and arg1.frame == arg2.frame:
+            current = frame[arg1.slot]
+            if type(current) is not StringBuffer:
+                current = StringBuffer(current)
+                frame[arg1.slot] = current
+            current.append(op2)
+        else:
+            frame[arg1.slot] = self.provenString(arg2) + op2
+        return position
+    def instLtJumpTyped(self, instruction, position):
+        compare, label, jumpWhen = instruction.args
+        arg1, arg2, arg3 = compare.args
+        result = self.provenValue(arg2) < self.provenValue(arg3)
+        self.provenFrame(arg1)[arg1.slot] = result
+        return label.value if result == jumpWhen else position
+    def instGtJumpTyped(self, instruction, position):
+        compare, label, jumpWhen = instruction.args
+        arg1, arg2, arg3 = compare.args
+        result = self.provenValue(arg2) > self.provenValue(arg3)
+        self.provenFrame(arg1)[arg1.slot] = result
+        return label.value if result == jumpWhen else position
+    def instEqJumpTyped(self, instruction, position):
+        compare, label, jumpWhen = instruction.args
+        arg1, arg2, arg3 = compare.args
+        result = self.provenValue(arg2) == self.provenValue(arg3)
+        self.provenFrame(arg1)[arg1.slot] = result
+        return label.value if result == jumpWhen else position
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="Argument parser for interpret.py", add_help=False)
@@ -1237,113 +2370,139 @@ if __name__ == "__main__":
                         action="store")
     parser.add_argument("--input", help="Input file with data to read",
                         action="store")
+    parser.add_argument("--buffer-size", help="Size of the output buffer in characters",
+                        action="store", type=int, default=OutputBuffer.DEFAULT_SIZE)
+    parser.add_argument("--optimize", help="Fuse common instruction sequences into superinstructions",
+                        action="store_true")
+    parser.add_argument("--stats", help="Write per-opcode execution statistics as JSON to this file",
+                        action="store")
+    parser.add_argument("--profile", help="Sample the running program and write collapsed stacks to this file",
+                        action="store")
+    parser.add_argument("--profile-interval", help="Sampling interval of --profile in seconds",
+                        action="store", type=float, default=0.001)
+    parser.add_argument("--compile-to-python", help="Translate the program into Python code and run that",
+                        action="store_true")
+    parser.add_argument("--no-cache", help="Do not read or write the compiled program cache",
+                        action="store_true")
+    parser.add_argument("--cache-dir", help="Directory of the compiled program cache",
+                        action="store", default=ProgramCache.defaultDirectory())
+    parser.add_argument("--serve", help="Run programs sent as JSON requests to this Unix socket",
+                        action="store")
+    parser.add_argument("--batch-inputs", help="Run the program once for every input file in this directory or glob",
+                        action="store")
+    parser.add_argument("--batch-output", help="Directory for the results of --batch-inputs",
+                        action="store", default="batch-output")
+    parser.add_argument("--jobs", help="Number of worker processes",
+                        action="store", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--unbuffered", help="Write output of every WRITE immediately",
+                        action="store_true")
+    parser.add_argument("--max-instructions", help="End a run after this many instructions with exit code "
+                        f"{ExecutionLimits.EXIT_CODE}", action="store", type=int)
+    parser.add_argument("--max-time", help="End a run after this many seconds with exit code "
+                        f"{ExecutionLimits.EXIT_CODE}", action="store", type=float)
+    parser.add_argument("--max-memory", help="End a run when the interpreter process holds more than this many MB of memory "
+                        f"with exit code {ExecutionLimits.EXIT_CODE}", action="store", type=int)
     args = parser.parse_args()
 
+    if args.jobs < 1:
+        sys.stderr.write("Number of jobs has to be positive")
+        sys.exit(10)
+
+    if args.serve:
+        InterpreterServer(args.serve, None if args.no_cache else args.cache_dir, args.jobs).serve()
+        sys.exit(0)
+
+    if args.batch_inputs:
+        if not args.source:
+            sys.stderr.write("Batch mode requires a source file")
+            sys.exit(10)
+        if args.input or args.stats or args.profile:
+            sys.stderr.write("Batch mode cannot be combined with --input, --stats or --profile")
+            sys.exit(10)
+        inputs = batchInputs(args.batch_inputs)
+        if not inputs:
+            sys.stderr.write(f"No input files match '{args.batch_inputs}'")
+            sys.exit(11)
+        names = batchNames(inputs)
+        if names == None:
+            sys.stderr.write("Batch inputs from different directories have the same file name")
+            sys.exit(10)
+
     if not args.source and not args.input:
         sys.stderr.write("Pleas provide either input file or a source file")
         sys.exit(10)
 
     if not args.input:
-        input_lines = []
-        while True:
-            try:
-                line = input()
-            except EOFError:
-                break
-            input_lines.append(line)
+        input_stream = sys.stdin
     else:
-        with open(args.input, 'r') as f:
-            input_lines = f.readlines()
-
-    if not args.source:
-        source_lines = ""
-        while True:
-            try:
-                line = input()
-            except EOFError:
-                break
-            source_lines += line
-
         try:
-            root = ET.fromstring(source_lines)
-        except ET.ParseError as e:
-            sys.stderr.write("Error parsing XML")
-            sys.exit(31)
-    else:
-        try:
-            source_xml = ET.parse(args.source)
-            root = source_xml.getroot()
-        except ET.ParseError as e:
-            sys.stderr.write("Error parsing XML")
-            sys.exit(31)
-
-    interpreter = Interpreter(input_lines)
+            input_stream = open(args.input, 'r')
+        except OSError as e:
+            sys.stderr.write(f"Cannot open input file: {e}")
+            sys.exit(11)
 
-    if root.tag != 'program':
-        sys.stderr.write("Missing header 'program' in XML")
-        sys.exit(32)
-
-    if not 'language' in root.attrib.keys():
-        sys.stderr.write("Not specified language in header of XML")
-
-    for atr in root.attrib.keys():
-        if not atr in ['language', 'name', 'description']:
-            sys.stderr.write("Unsupported attributes in header of XML")
-            sys.exit(32)
-
-    if root.attrib['language'].upper() != 'IPPCODE23':
-        sys.stderr.write("Language not supported by this interpret")
-        sys.exit(32)
-
-    order_dict = {}
-    for inst in root:
-
-        if inst.tag != 'instruction':
-            sys.stderr.write("Every element has to be 'instruction'")
-            sys.exit(32)
-
-        for c in inst.attrib:
-            if not c in ['opcode', 'order']:
-                sys.stderr.write("Unsupported attribute in XML structure")
-                sys.exit(32)
-
-        try:
-            new_inst = Instruction(inst.attrib['order'], inst.attrib['opcode'])
-
-        except Exception as ex:
-            sys.stderr.write("Order or opcode is missing")
-            sys.exit(32)
-
-
-        if inst.attrib['order'] in order_dict:
-            sys.stderr.write("Duplicate 'Order' attribute in XML")
-            sys.exit(32)
-        else:
-            order_dict.update({inst.attrib['order'] : inst.attrib['opcode']})
-
-        if not inst.attrib['opcode'].upper() in ["CREATEFRAME", "PUSHFRAME", "POPFRAME", "RETURN", "BREAK",
-       "DEFVAR", "POPS", "CALL", "LABEL", "JUMP", "PUSHS", "WRITE", "EXIT", "DPRINT",
-        "MOVE", "INT2CHAR", "STRLEN", "TYPE", "READ", "NOT", "ADD", "SUB",
-        "MUL", "IDIV", "LT", "GT", "EQ", "AND", "OR", "STRI2INT", "CONCAT",
-        "GETCHAR", "SETCHAR", "JUMPIFEQ", "JUMPIFNEQ"]:
-            sys.stderr.write("Neznámá nebo špatně zapsaná instrukce")
-            sys.exit(32)
+    if args.buffer_size < 0:
+        sys.stderr.write("Buffer size cannot be negative")
+        sys.exit(10)
 
-        for c in inst:
-            if len(c.attrib) != 1:
-                sys.stderr.write("Argument have more than 'type' ")
-                sys.exit(32)
+    limits = None
+    if args.max_instructions != None or args.max_time != None or args.max_memory != None:
+        if any(limit != None and limit <= 0 for limit in (args.max_instructions, args.max_time, args.max_memory)):
+            sys.stderr.write("Limits have to be positive")
+            sys.exit(10)
+        limits = ExecutionLimits(args.max_instructions, args.max_time, args.max_memory)
+
+    output = OutputBuffer(sys.stdout, 0 if args.unbuffered else args.buffer_size)
+    program = Program()
+    if args.no_cache:
+        loadProgram(args.source if args.source else sys.stdin.buffer, program)
+    else:
+        if args.source:
             try:
-                try:
-                    new_arg = Argument(c.attrib['type'], c.text.strip())
-                except:
-                    new_arg = Argument(c.attrib['type'], c.text)
-            except Exception as ex:
-                sys.stderr.write("Argument doesn't have type attribute")
-                sys.exit(32)
-
-            new_inst.addArgument(c.tag, new_arg)
-
-        interpreter.instList.append(new_inst)
-
+                source = open(args.source, 'rb')
+            except OSError as e:
+                sys.stderr.write(f"Cannot open source file: {e}")
+                sys.exit(11)
+        else:
+            # standard input can only be read once, it is spooled to a
+            # temporary file so it can be parsed after hashing
+            source = tempfile.TemporaryFile()
+            shutil.copyfileobj(sys.stdin.buffer, source)
+            source.seek(0)
+
+        cache = ProgramCache(args.cache_dir)
+        with source:
+            key = cache.fileKey(source)
+            if not cache.load(key, program):
+                source.seek(0)
+                loadProgram(source, program)
+                program.prepare()
+                cache.store(key, program)
+    program.finish(args.optimize)
+    if args.optimize:
+        sys.stderr.write(program.simplifySummary())
+        sys.stderr.write(program.fusionSummary())
+
+    if args.compile_to_python:
+        if args.stats or args.profile:
+            sys.stderr.write("Translated programs cannot be run with --stats or --profile")
+            sys.exit(10)
+        if args.no_cache:
+            program.compileToPython()
+        else:
+            program.compileToPython(cache, key)
+
+    if args.batch_inputs:
+        runBatch(program, inputs, names, args.batch_output, args.jobs, limits)
+        sys.exit(0)
+
+    interpreter = Interpreter(program, InputReader(input_stream), output)
+    interpreter.statsFile = args.stats
+    interpreter.limits = limits
+    if args.profile:
+        if args.profile_interval <= 0:
+            sys.stderr.write("Profiling interval has to be positive")
+            sys.exit(10)
+        interpreter.profiler = SamplingProfiler(args.profile_interval)
+        interpreter.profileFile = args.profile
     interpreter.interpretInst()
@@ -0,0 +1,193 @@
+import argparse
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIES = ["ipp-2023-tests", "tests", "test_nevol"]
+
+# state of a worker process, set up once by initWorker
+interpret = None
+compiled = {}
+settings = {}
+
+
+class CaseTimeout(Exception):
+    pass
+
+
+def findCases(directories, pattern):
+    # Only cases whose source is already XML can be run by the interpreter,
+    # the IPPcode23 sources of the parser tests are counted as skipped.
+    cases = []
+    skipped = 0
+    for directory in directories:
+        for source in glob.glob(os.path.join(directory, "**", "*.src"), recursive=True):
+            if pattern and not pattern in source:
+                continue
+            with open(source, "rb") as f:
+                head = f.read(256).lstrip()
+            if head.startswith(b"<?xml") or head.startswith(b"<program"):
+                cases.append(source)
+            else:
+                skipped += 1
+    return sorted(cases), skipped
+
+
+def readExpected(base):
+    rc = 0
+    if os.path.exists(base + ".rc"):
+        with open(base + ".rc") as f:
+            text = f.read().strip()
+        rc = int(text) if text else 0
+    output = b""
+    if os.path.exists(base + ".out"):
+        with open(base + ".out", "rb") as f:
+            output = f.read()
+    return rc, output
+
+
+def initWorker(optimize, timeout, backend):
+    global interpret
+    sys.path.insert(0, ROOT)
+    import interpret_old
+    interpret = interpret_old
+    settings["optimize"] = optimize
+    settings["timeout"] = timeout
+    settings["backend"] = backend
+    signal.signal(signal.SIGALRM, timeoutHandler)
+
+
+def timeoutHandler(signum, frame):
+    raise CaseTimeout()
+
+
+def loadCase(data):
+    # Programs are loaded once per worker and shared by all later cases with
+    # the same source, a failed load is remembered as its LoadError.
+    key = hashlib.sha256(data).hexdigest()
+    if not key in compiled:
+        try:
+            program = interpret.load(data, settings["optimize"])
+            if settings["backend"] != "interpreter":
+                program.compileToPython()
+            compiled[key] = program
+        except interpret.LoadError as e:
+            compiled[key] = e
+    return compiled[key]
+
+
+def readLimits(base):
+    # NAME.limits holds the run limits of a case as a JSON object with
+    # "max_instructions", "max_time" and "max_memory", e.g. {"max_instructions": 1000}
+    if not os.path.exists(base + ".limits"):
+        return None
+    with open(base + ".limits") as f:
+        fields = json.load(f)
+    return interpret.ExecutionLimits(*(fields.get(name) for name in ("max_instructions", "max_time", "max_memory")))
+
+
+def runProgram(program, inputText, compiled, limits):
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    code = program.run(io.StringIO(inputText), stdout, stderr, compiled, limits).exitCode
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+def runCase(source):
+    base = source[:-len(".src")]
+    with open(source, "rb") as f:
+        data = f.read()
+    inputText = ""
+    if os.path.exists(base + ".in"):
+        with open(base + ".in", "r") as f:
+            inputText = f.read()
+    limits = readLimits(base)
+
+    code, stdout, stderr = 0, "", ""
+    other = None
+    timedOut = False
+    start = time.perf_counter()
+    signal.setitimer(signal.ITIMER_REAL, settings["timeout"])
+    try:
+        program = loadCase(data)
+        if isinstance(program, interpret.LoadError):
+            code, stderr = program.exitCode, program.message
+        else:
+            code, stdout, stderr = runProgram(program, inputText, settings["backend"] == "python", limits)
+            if settings["backend"] == "both":
+                other = runProgram(program, inputText, True, limits)
+    except CaseTimeout:
+        timedOut = True
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        elapsed = time.perf_counter() - start
+
+    expectedCode, expectedOutput = readExpected(base)
+    # the message of an exceeded limit includes the time and memory of the run
+    compared = (code, stdout) if limits else (code, stdout, stderr)
+    if timedOut:
+        status, reason = "FAIL", "timeout"
+    elif other != None and other[:len(compared)] != compared:
+        status, reason = "FAIL", f"backends differ: interpreter exit code {code}, translation exit code {other[0]}"
+    elif code != expectedCode:
+        status, reason = "FAIL", f"exit code {code}, expected {expectedCode}"
+    elif code == 0 and stdout.encode() != expectedOutput:
+        status, reason = "FAIL", "output differs"
+    else:
+        status, reason = "PASS", ""
+    return {"case": os.path.relpath(base, ROOT), "status": status, "reason": reason, "time": elapsed,
+            "exit_code": code, "stderr": stderr[:200]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the interpret test cases in parallel worker processes")
+    parser.add_argument("directories", nargs="*", help="Directories with test cases (default: all test directories)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--filter", help="Only run cases whose path contains this text")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Time limit of one case in seconds")
+    parser.add_argument("--optimize", action="store_true", help="Run the programs with --optimize")
+    parser.add_argument("--backend", choices=["interpreter", "python", "both"], default="interpreter",
+                        help="Run the dispatch loop, the --compile-to-python translation, or both and compare them")
+    parser.add_argument("--json", help="Write the results of all cases as JSON to this file")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Print passing cases as well")
+    args = parser.parse_args()
+
+    directories = args.directories or [os.path.join(ROOT, d) for d in DIRECTORIES]
+    cases, skipped = findCases(directories, args.filter)
+    if args.jobs < 1:
+        sys.stderr.write("Number of jobs has to be positive")
+        sys.exit(10)
+
+    results = []
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.jobs, initWorker, (args.optimize, args.timeout, args.backend)) as pool:
+        for result in pool.imap_unordered(runCase, cases):
+            results.append(result)
+            if result["status"] == "FAIL" or args.verbose:
+                line = f"{result['status']} {result['case']} ({result['time'] * 1000:.1f} ms)"
+                print(line + (f": {result['reason']}" if result["reason"] else ""))
+    wall = time.perf_counter() - start
+
+    results.sort(key=lambda r: r["case"])
+    passed = sum(r["status"] == "PASS" for r in results)
+    busy = sum(r["time"] for r in results)
+    print(f"{passed} / {len(results)} passed, {skipped} skipped, {wall:.2f} s wall, "
+          f"{busy:.2f} s in cases, {args.jobs} jobs")
+    slowest = sorted(results, key=lambda r: r["time"], reverse=True)[:5]
+    for r in slowest:
+        print(f"  slow: {r['case']} {r['time'] * 1000:.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"passed": passed, "total": len(results), "skipped": skipped, "wall_time": wall,
+                       "cases": results}, f, indent=2)
+
+    if passed != len(results):
+        sys.exit(1)
@@ -0,0 +1,174 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INTERPRET = os.path.join(ROOT, "interpret_old.py")
+KOULE = os.path.join(ROOT, "ipp-2023-tests", "koule", "Lakoc", "koule_Lakoc.xml")
+
+
+def corpus(name):
+    with open(os.path.join(ROOT, "test_nevol", name + ".src")) as f:
+        return f.read()
+
+
+class Server:
+    # An interpret_old.py --serve process on a socket in a temporary directory.
+    def __init__(self, directory, *options, command=None):
+        self.path = os.path.join(directory, "server.sock")
+        self.process = subprocess.Popen(command or [sys.executable, INTERPRET, "--serve", self.path] + list(options),
+                                        stderr=subprocess.PIPE, text=True)
+        # a stale socket may be at the path already, so wait for a connection
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                self.connect().close()
+                break
+            except OSError:
+                if self.process.poll() != None or time.monotonic() > deadline:
+                    raise RuntimeError("Server did not start: " + self.process.stderr.read())
+                time.sleep(0.02)
+
+    def connect(self):
+        client = socket.socket(socket.AF_UNIX)
+        client.connect(self.path)
+        return client.makefile("rwb")
+
+    def request(self, request, connection=None):
+        connection = connection or self.connect()
+        connection.write(request if isinstance(request, bytes) else json.dumps(request).encode() + b"\n")
+        connection.flush()
+        return json.loads(connection.readline())
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        code = self.process.wait(10)
+        stderr = self.process.stderr.read()
+        self.process.stderr.close()
+        return code, stderr
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, "cache")
+        self.server = Server(self.directory.name, "--cache-dir", self.cache, "--jobs", "1")
+
+    def tearDown(self):
+        code, stderr = self.server.stop()
+        self.directory.cleanup()
+        self.assertEqual(code, 0)
+        self.assertEqual(stderr, "")
+
+    def test_round_trip(self):
+        response = self.server.request({"source": corpus("LIMITS/within_budget")})
+        self.assertEqual(response["stdout"], "0123456789")
+        self.assertEqual(response["exit_code"], 0)
+        self.assertEqual(len(response["hash"]), 64)
+
+    def test_hash_reuse(self):
+        first = self.server.request({"source": corpus("READ/read_string")})
+        second = self.server.request({"hash": first["hash"], "input": "again\n"})
+        self.assertEqual(second["hash"], first["hash"])
+        self.assertEqual(second["stdout"], "again")
+        self.assertTrue(os.path.exists(os.path.join(self.cache, first["hash"] + ".ippc")))
+
+    def test_unknown_hash(self):
+        response = self.server.request({"hash": "0" * 64})
+        self.assertEqual(response["error"], "Unknown program hash")
+
+    def test_invalid_hash(self):
+        for key in ("../../x", "A" * 64, "0" * 63):
+            self.assertEqual(self.server.request({"hash": key}), {"error": "Invalid hash"})
+
+    def test_invalid_requests(self):
+        connection = self.server.connect()
+        self.assertIn("Invalid request", self.server.request(b"{not json\n", connection)["error"])
+        self.assertIn("Invalid request", self.server.request(b"[1, 2]\n", connection)["error"])
+        self.assertIn("has to be a string", self.server.request({"source": 123}, connection)["error"])
+        self.assertIn("has to be a string", self.server.request({"hash": "0" * 64, "input": 5}, connection)["error"])
+        # the connection stays usable after every error
+        response = self.server.request({"source": corpus("LIMITS/within_budget")}, connection)
+        self.assertEqual(response["exit_code"], 0)
+
+    def test_large_source(self):
+        with open(KOULE) as f:
+            source = f.read()
+        self.assertGreater(len(source), 64 * 1024)
+        response = self.server.request({"source": source})
+        # koule uses FLOAT, which the interpreter does not support
+        self.assertEqual(response["exit_code"], 32)
+
+    def test_limits(self):
+        response = self.server.request({"source": corpus("LIMITS/endless_loop"), "max_instructions": 1000})
+        self.assertEqual(response["exit_code"], 60)
+        # workers hold many programs, so their memory cannot limit one run
+        response = self.server.request({"source": corpus("LIMITS/endless_loop"), "max_memory": 100})
+        self.assertEqual(response["error"], "The server does not support max_memory")
+
+    def test_worker_death(self):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            self.server.request({"source": corpus("LIMITS/endless_loop"), "max_time": 10})))
+        thread.start()
+        time.sleep(0.5)
+        workers = subprocess.run(["pgrep", "-P", str(self.server.process.pid)], capture_output=True, text=True)
+        for pid in workers.stdout.split():
+            os.kill(int(pid), signal.SIGKILL)
+        thread.join(10)
+        self.assertIn("error", result[0])
+        response = self.server.request({"source": corpus("LIMITS/within_budget")})
+        self.assertEqual(response["stdout"], "0123456789")
+
+
+class ServerSocketTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "server.sock")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(self.path)
+        stale.close()
+        server = Server(self.directory.name, "--no-cache")
+        try:
+            response = server.request({"source": corpus("LIMITS/within_budget")})
+            self.assertEqual(response["exit_code"], 0)
+        finally:
+            self.assertEqual(server.stop(), (0, ""))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_other_file(self):
+        with open(self.path, "w") as f:
+            f.write("notes")
+        process = subprocess.run([sys.executable, INTERPRET, "--serve", self.path], capture_output=True, text=True)
+        self.assertEqual(process.returncode, 12)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "notes")
+
+    def test_line_limit(self):
+        command = [sys.executable, "-c", "import sys; sys.path.insert(0, sys.argv[1]); import interpret_old; "
+                   "interpret_old.InterpreterServer.LINE_LIMIT = 4096; "
+                   "interpret_old.InterpreterServer(sys.argv[2], None, 1).serve()", ROOT, self.path]
+        server = Server(self.directory.name, command=command)
+        try:
+            connection = server.connect()
+            response = server.request({"source": "x" * 10000}, connection)
+            self.assertIn("longer than 4096 bytes", response["error"])
+            self.assertEqual(connection.readline(), b"")
+        finally:
+            self.assertEqual(server.stop(), (0, ""))
+
+
+if __name__ == "__main__":
+    unittest.main()